@@ -0,0 +1,154 @@
+from array import array
+
+UP, DOWN, LEFT, RIGHT = range(4)
+DIRECTIONS = ("up", "down", "left", "right")
+DELTAS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+RUN_CODES = ("u", "d", "l", "r")
+
+class ActionLog:
+    # moves as parallel int columns (direction, steps, from x, from y); "to" is derived.
+    # dicts only get built when a result is serialized
+    __slots__ = ("directions", "steps", "xs", "ys")
+
+    def __init__(self):
+        self.directions = array("b")
+        self.steps = array("q")
+        self.xs = array("q")
+        self.ys = array("q")
+
+    def append(self, direction: int, steps: int, x: int, y: int):
+        try:
+            self.steps.append(steps)
+            self.xs.append(x)
+            self.ys.append(y)
+        except (OverflowError, TypeError):
+            # values that don't fit an int64 (or a position player code set to a float) fall back to lists
+            del self.steps[len(self.directions):], self.xs[len(self.directions):], self.ys[len(self.directions):]
+            self.steps, self.xs, self.ys = list(self.steps), list(self.xs), list(self.ys)
+            self.steps.append(steps)
+            self.xs.append(x)
+            self.ys.append(y)
+        self.directions.append(direction)
+
+    def __len__(self):
+        return len(self.directions)
+
+    def action(self, i: int) -> dict:
+        direction, steps, x, y = self.directions[i], self.steps[i], self.xs[i], self.ys[i]
+        dx, dy = DELTAS[direction]
+        return {
+            "type": "move",
+            "direction": DIRECTIONS[direction],
+            "steps": steps,
+            "from": {"x": x, "y": y},
+            # the axis that didn't move is passed through, player code may have set it to anything
+            "to": {"x": x + dx * steps if dx else x, "y": y + dy * steps if dy else y}
+        }
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.action(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("action index out of range")
+        return self.action(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.action(i)
+
+    def __eq__(self, other):
+        if isinstance(other, ActionLog):
+            return (self.directions == other.directions and list(self.steps) == list(other.steps)
+                    and list(self.xs) == list(other.xs) and list(self.ys) == list(other.ys))
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def to_list(self) -> list:
+        return [self.action(i) for i in range(len(self))]
+
+    def slice(self, start: int, stop: int) -> "ActionLog":
+        log = ActionLog()
+        log.directions = self.directions[start:stop]
+        log.steps = self.steps[start:stop]
+        log.xs = self.xs[start:stop]
+        log.ys = self.ys[start:stop]
+        return log
+
+    def to_runs(self) -> dict:
+        # compact wire form: consecutive identical moves collapse into [direction, steps, count];
+        # positions are implied by the origin, a run only carries [.., jump_x, jump_y] when the
+        # player was moved some other way between actions. positions that can't be subtracted (player
+        # code set one to a string, say) go out as the plain action list instead
+        runs = []
+        if not len(self):
+            return {"format": "rle", "origin": None, "runs": runs}
+        px, py = self.xs[0], self.ys[0]
+        origin = [px, py]
+        last = None
+        try:
+            for direction, steps, x, y in zip(self.directions, self.steps, self.xs, self.ys):
+                if last is not None and last[0] == RUN_CODES[direction] and last[1] == steps and x == px and y == py:
+                    last[2] += 1
+                else:
+                    last = [RUN_CODES[direction], steps, 1]
+                    if x != px or y != py:
+                        last += [x - px, y - py]
+                    runs.append(last)
+                dx, dy = DELTAS[direction]
+                px, py = x + dx * steps, y + dy * steps
+        except TypeError:
+            return {"format": "list", "actions": self.to_list()}
+        return {"format": "rle", "origin": origin, "runs": runs}
+
+    @classmethod
+    def from_runs(cls, encoded: dict) -> "ActionLog":
+        log = cls()
+        if encoded["format"] == "list":
+            for action in encoded["actions"]:
+                log.append(DIRECTIONS.index(action["direction"]), action["steps"], action["from"]["x"], action["from"]["y"])
+            return log
+        if not encoded["runs"]:
+            return log
+        px, py = encoded["origin"]
+        for run in encoded["runs"]:
+            direction, steps, count = RUN_CODES.index(run[0]), run[1], run[2]
+            if len(run) == 5:
+                px, py = px + run[3], py + run[4]
+            dx, dy = DELTAS[direction]
+            for _ in range(count):
+                log.append(direction, steps, px, py)
+                px, py = px + dx * steps, py + dy * steps
+        return log
+
+    def extend(self, other: "ActionLog", limit: int = None):
+        # keeps only the newest `limit` actions
+        for i in range(len(other)):
+            self.append(other.directions[i], other.steps[i], other.xs[i], other.ys[i])
+        if limit is not None and len(self) > limit:
+            drop = len(self) - limit
+            del self.directions[:drop], self.steps[:drop], self.xs[:drop], self.ys[:drop]
+
+    def translated(self, dx: int, dy: int) -> "ActionLog":
+        log = ActionLog()
+        log.directions = self.directions
+        log.steps = self.steps
+        if dx == 0 and dy == 0:
+            log.xs, log.ys = self.xs, self.ys
+            return log
+        try:
+            log.xs = array("q", [x + dx for x in self.xs])
+            log.ys = array("q", [y + dy for y in self.ys])
+        except (OverflowError, TypeError):
+            log.steps = list(self.steps)
+            log.xs = [x + dx for x in self.xs]
+            log.ys = [y + dy for y in self.ys]
+        return log
+
+    def nbytes(self) -> int:
+        return sum(
+            column.itemsize * len(column) if isinstance(column, array) else 8 * len(column)
+            for column in (self.directions, self.steps, self.xs, self.ys)
+        )
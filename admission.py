@@ -0,0 +1,85 @@
+import asyncio
+from collections import deque
+from typing import Dict
+
+class AdmissionController:
+    # caps running executions at the backend's worker count and keeps the overflow in a bounded,
+    # visible FIFO instead of the executor's unbounded internal queue
+    def __init__(self, max_running: int, max_queue: int = 1000):
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiters = deque()
+        self.in_flight: Dict[str, str] = {}
+
+    def queue_position(self, session_id: str) -> int:
+        for position, (waiting_session, _) in enumerate(self.waiters, 1):
+            if waiting_session == session_id:
+                return position
+        return 0
+
+    def try_admit(self, session_id: str, code: str) -> dict:
+        # one in-flight execution per session: a resubmit of the same code rides along, anything else bounces
+        if session_id in self.in_flight:
+            status = "coalesced" if self.in_flight[session_id] == code else "busy"
+            return {
+                "status": status,
+                "reason": "in_flight",
+                "position": self.queue_position(session_id),
+                "queue_length": len(self.waiters)
+            }
+        if self.running >= self.max_running and len(self.waiters) >= self.max_queue:
+            return {"status": "busy", "reason": "overloaded", "position": 0, "queue_length": len(self.waiters)}
+
+        self.in_flight[session_id] = code
+        # the slot (or the place in line) is taken right here, so the reported position is exact
+        ticket = {"status": "admitted", "session_id": session_id, "waiter": None, "started": False}
+        if self.running < self.max_running and not self.waiters:
+            self.running += 1
+            ticket["position"] = 0
+        else:
+            ticket["waiter"] = asyncio.get_running_loop().create_future()
+            self.waiters.append((session_id, ticket["waiter"]))
+            ticket["position"] = len(self.waiters)
+        ticket["queue_length"] = len(self.waiters)
+        return ticket
+
+    async def wait(self, ticket: dict):
+        # release() hands its slot straight to the waiter, so running stays counted
+        if ticket["waiter"] is not None:
+            await ticket["waiter"]
+
+    def start(self, ticket: dict):
+        ticket["started"] = True
+
+    def abandon(self, ticket: dict):
+        # cleanup for a submission that ends before its execution started (cancelled or failed)
+        if ticket["started"]:
+            return
+        waiter = ticket["waiter"]
+        if waiter is None or (waiter.done() and not waiter.cancelled()):
+            self.release()
+            return
+        waiter.cancel()
+        entry = (ticket["session_id"], waiter)
+        if entry in self.waiters:
+            self.waiters.remove(entry)
+
+    def release(self):
+        while self.waiters:
+            _, waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def finish(self, session_id: str):
+        self.in_flight.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "max_running": self.max_running,
+            "queued": len(self.waiters),
+            "max_queue": self.max_queue
+        }
@@ -0,0 +1,316 @@
+import ast
+import threading
+from collections import OrderedDict
+from fast_path import recognize
+from sandbox import DEFAULT_BUDGET, SAFE_BUILTINS, source_hash
+
+# names every program may use without defining them
+KNOWN_NAMES = frozenset(SAFE_BUILTINS) | {"player", "print"}
+# attributes that lead from plain objects back to frames, globals and builtins
+INTROSPECTION_ATTRS = frozenset((
+    "gi_frame", "gi_code", "cr_frame", "cr_code", "ag_frame", "ag_code",
+    "f_back", "f_builtins", "f_globals", "f_locals", "f_code", "tb_frame", "tb_next",
+))
+# exponents larger than this are not folded, the loop is just treated as unknown
+MAX_FOLD_EXPONENT = 64
+# builtins that consume a whole iterable in C, and the lazy ones that just pass theirs through
+BULK_BUILTINS = frozenset(("sum", "min", "max", "list", "tuple", "dict"))
+LAZY_BUILTINS = frozenset(("enumerate", "zip"))
+
+def _verdict(error_type: str, error: str, node, lines: list) -> dict:
+    line = getattr(node, "lineno", None) or 1
+    return {
+        "error_type": error_type,
+        "error": error,
+        "line": line,
+        "text": lines[line - 1].strip() if line <= len(lines) else ""
+    }
+
+def _bound_names(tree) -> set:
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ExceptHandler, ast.MatchAs, ast.MatchStar)):
+            if node.name:
+                bound.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bound.add(node.rest)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+    return bound
+
+def _evaluated(node):
+    # the parts of an expression that are evaluated whenever the expression itself is
+    yield node
+    if isinstance(node, ast.Lambda):
+        return
+    if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+        yield from _evaluated(node.generators[0].iter)
+    elif isinstance(node, ast.BoolOp):
+        yield from _evaluated(node.values[0])
+    elif isinstance(node, ast.IfExp):
+        yield from _evaluated(node.test)
+    else:
+        for child in ast.iter_child_nodes(node):
+            yield from _evaluated(child)
+
+def _always_evaluated(statements: list):
+    # nodes that run every time the program does: top-level statements, the headers of compound ones
+    # and `with` bodies; nothing under if/try/loop bodies or function definitions
+    for statement in statements:
+        if isinstance(statement, (ast.If, ast.While)):
+            yield from _evaluated(statement.test)
+        elif isinstance(statement, (ast.For, ast.AsyncFor)):
+            yield from _evaluated(statement.iter)
+        elif isinstance(statement, (ast.With, ast.AsyncWith)):
+            for item in statement.items:
+                yield from _evaluated(item.context_expr)
+            yield from _always_evaluated(statement.body)
+        elif isinstance(statement, ast.Match):
+            yield from _evaluated(statement.subject)
+        elif not isinstance(statement, (ast.Try, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            yield from _evaluated(statement)
+
+def _find_disallowed(tree, lines: list, bound: set):
+    # imports, dunders, underscore attributes and class bodies are refused wherever they appear
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            return _verdict("rejected", "imports are not allowed", node, lines)
+        if isinstance(node, ast.ClassDef):
+            return _verdict("rejected", "class definitions are not supported", node, lines)
+        # underscore attributes include the player's private ones, which lead back to the executor
+        if isinstance(node, ast.Attribute) and (node.attr.startswith("_") or node.attr in INTROSPECTION_ATTRS):
+            return _verdict("rejected", f"access to attribute '{node.attr}' is not allowed", node, lines)
+        if isinstance(node, ast.Name) and node.id.startswith("__"):
+            return _verdict("rejected", f"name '{node.id}' is not allowed", node, lines)
+    return None
+
+def _unknown_names(tree, lines: list, bound: set) -> tuple:
+    # ((name, verdict), ...) for names looked up on every run that nothing defines; a notebook
+    # session may have defined them in an earlier cell, so they're judged per call
+    unknown = {}
+    for node in _always_evaluated(tree.body):
+        if (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in unknown
+                and node.id not in KNOWN_NAMES and node.id not in bound):
+            unknown[node.id] = _verdict("rejected", f"NameError: name '{node.id}' is not defined", node, lines)
+    return tuple(unknown.items())
+
+def _const_int(node):
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _const_int(node.operand)
+        if value is not None:
+            return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp):
+        left, right = _const_int(node.left), _const_int(node.right)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        if isinstance(node.op, ast.FloorDiv) and right:
+            return left // right
+        if isinstance(node.op, ast.Pow) and 0 <= right <= MAX_FOLD_EXPONENT:
+            return left ** right
+    return None
+
+def _range_length(node):
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "range"):
+        return None
+    if node.keywords or not 1 <= len(node.args) <= 3:
+        return None
+    args = [_const_int(arg) for arg in node.args]
+    if None in args:
+        return None
+    try:
+        return len(range(*args))
+    except (ValueError, OverflowError):
+        return None
+
+def _lazy_length(node, bound: set):
+    # items iterating over `node` yields: a constant range, or enumerate/zip over those
+    length = _range_length(node)
+    if length is not None or not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+        return length
+    if node.func.id not in LAZY_BUILTINS or node.func.id in bound or node.keywords or not node.args:
+        return None
+    lengths = [_lazy_length(arg, bound) for arg in node.args]
+    if node.func.id == "enumerate":
+        return lengths[0]
+    return None if None in lengths else min(lengths)
+
+def _bulk_length(tree, bound: set):
+    # (items, call) for the largest constant range a builtin walks through in C, e.g. sum(range(10**12));
+    # no tick runs in there, so nothing would stop it before it's done
+    worst, worst_length = None, 0
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in BULK_BUILTINS and node.func.id not in bound):
+            continue
+        for arg in node.args:
+            length = _lazy_length(arg, bound)
+            if length is not None and length > worst_length:
+                worst, worst_length = node, length
+    return worst_length, worst
+
+def _exits(loop) -> bool:
+    # a break (for this loop) or return anywhere in the body may cut it short
+    pending = list(loop.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.Break, ast.Return)):
+            return True
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            # their own breaks don't leave this loop, only their else blocks can
+            pending.extend(node.orelse)
+            continue
+        pending.extend(ast.iter_child_nodes(node))
+    return False
+
+def _min_ticks(statements: list, ranges_trusted: bool):
+    # lower bound on loop ticks for statements that always run, with the loop contributing the most;
+    # only `for ... in range(<constants>)` and `while <truthy constant>` are counted, everything else is 0
+    total, worst, worst_ticks = 0, None, 0
+    for node in statements:
+        if isinstance(node, ast.For) and ranges_trusted:
+            length = _range_length(node.iter)
+            if length is None:
+                continue
+            inner, _ = _min_ticks(node.body, ranges_trusted)
+            ticks = (min(length, 1) if _exits(node) else length) * (1 + inner)
+        elif isinstance(node, ast.While):
+            if not (isinstance(node.test, ast.Constant) and node.test.value) or _exits(node):
+                continue
+            ticks = float("inf")
+        else:
+            continue
+        total += ticks
+        if ticks > worst_ticks:
+            worst, worst_ticks = node, ticks
+    return total, worst
+
+def analyze(code: str):
+    # (verdict or None, minimum loop ticks, the loop responsible, fast path plan or None, unknown names);
+    # a SyntaxError is a verdict too, worded exactly like the one the executor reports. an unknown name
+    # is only reported where it is certain to be looked up, a typo in a branch that never runs is fine
+    try:
+        return _analyze(code)
+    except (RecursionError, MemoryError) as e:
+        # deeply nested source overflows the parser or the recursive walks; compiling it would fail the
+        # same way, so it becomes a (cached) runtime error verdict
+        verdict = {"error_type": "runtime_error", "error": f"{type(e).__name__}: {e}", "line": 1, "text": ""}
+        return verdict, 0, None, None, ()
+
+def _analyze(code: str):
+    lines = code.splitlines()
+    try:
+        tree = ast.parse(code, "<string>", "exec")
+    except SyntaxError as e:
+        verdict = {
+            "error_type": "syntax_error",
+            "error": f"Syntax Error: {str(e)}",
+            "line": e.lineno or 1,
+            "text": e.text.strip() if e.text else ""
+        }
+        return verdict, 0, None, None, ()
+    bound = _bound_names(tree)
+    verdict = _find_disallowed(tree, lines, bound)
+    if verdict is not None:
+        return verdict, 0, None, None, ()
+    ticks, loop = _min_ticks(tree.body, "range" not in bound)
+    loop_verdict = None
+    if loop is not None:
+        loop_verdict = _verdict("budget_exceeded", "loop", loop, lines)
+    if "range" not in bound:
+        length, call = _bulk_length(tree, bound)
+        if length > ticks:
+            ticks, loop_verdict = length, _verdict("budget_exceeded", f"{call.func.id}() over a range", call, lines)
+    return None, ticks, loop_verdict, recognize(tree), _unknown_names(tree, lines, bound)
+
+class AnalysisCache:
+    # verdicts by source hash, so a repeated submission is judged with one dict lookup
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+        self.lock = threading.Lock()
+
+    def check(self, code: str, max_ticks: int = DEFAULT_BUDGET.max_ticks, defined: frozenset = None):
+        # None when the program may run, otherwise a verdict dict (error_type, error, line, text)
+        return self.inspect(code, max_ticks, defined=defined)[0]
+
+    def lookup(self, code: str, max_ticks: int = DEFAULT_BUDGET.max_ticks, defined: frozenset = None):
+        # check() from the cache alone, for the event loop: a program that hasn't been analyzed yet gets
+        # None and is analyzed by the executor, off the loop
+        key = source_hash(code)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return self.judge(entry, max_ticks, DEFAULT_BUDGET.max_actions, defined)[0]
+
+    def inspect(self, code: str, max_ticks: int = DEFAULT_BUDGET.max_ticks, max_actions: int = DEFAULT_BUDGET.max_actions,
+                defined: frozenset = None):
+        # (verdict, fast path plan); the plan is only handed out when it fits the budget, exec reports the rest.
+        # `defined` are names a notebook session's earlier cells left behind
+        key = source_hash(code)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            entry = analyze(code)
+            with self.lock:
+                self.entries[key] = entry
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return self.judge(entry, max_ticks, max_actions, defined)
+
+    def judge(self, entry: tuple, max_ticks: int, max_actions: int, defined: frozenset = None):
+        verdict, ticks, loop, plan, unknown = entry
+        if verdict is None:
+            for name, name_verdict in unknown:
+                if defined is None or name not in defined:
+                    verdict = name_verdict
+                    break
+        # a `range` from an earlier cell means the range loops weren't what they looked like
+        if verdict is None and ticks > max_ticks and (defined is None or "range" not in defined or ticks == float("inf")):
+            # judged per call, the same source can run under different budgets
+            estimate = "never ends" if ticks == float("inf") else f"needs at least {ticks} iterations"
+            verdict = dict(loop, error=f"BudgetExceeded: {loop['error']} {estimate}, the limit is {max_ticks}")
+        if verdict is not None:
+            with self.lock:
+                self.rejections += 1
+            return verdict, None
+        if plan is not None and (plan["ticks"] > max_ticks or len(plan["actions"]) > max_actions):
+            plan = None
+        return None, plan
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejections": self.rejections
+            }
+
+analysis_cache = AnalysisCache()
@@ -0,0 +1,281 @@
+import asyncio
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import weakref
+from functools import partial
+from game_executor import GameExecutor
+from sandbox import BudgetExceeded
+from tracing import Trace
+
+# extra time a worker gets past its wall budget before it's killed and replaced
+HARD_KILL_GRACE = 1.0
+
+def _worker_main(conn):
+    # a fresh executor per job, so nothing a program leaves on its player or globals reaches the next
+    # session on this worker; notebook sessions pinned here keep theirs between cells, by notebook key
+    notebooks = {}
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        state, code, stream, traced, fresh, notebook, forget = job
+        for key in forget:
+            notebooks.pop(key, None)
+        if notebook is None:
+            executor = GameExecutor()
+        else:
+            executor = notebooks.get(notebook)
+            if executor is None:
+                executor = notebooks[notebook] = GameExecutor()
+                executor.notebook = True
+        executor.set_state(state)
+        on_actions = (lambda batch: conn.send(("batch", batch))) if stream else None
+        trace = Trace(0, "worker") if traced else None
+        if isinstance(code, list):
+            result = executor.execute_batch(code, fresh, trace)
+        else:
+            result = executor.execute_player_code(code, on_actions, trace)
+        info = (executor.namespace_names, executor.namespace_bytes) if notebook is not None else None
+        conn.send(("result", result, executor.get_state(), trace.spans if traced else None, info))
+
+class _Worker:
+    def __init__(self, ctx, slot: int):
+        self.slot = slot
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, state, code, timeout: float = None, on_actions=None, trace=None, fresh: bool = False,
+            notebook: str = None, forget: list = ()):
+        # `code` is a single program or a list of them (a batch, answered with a list of results);
+        # returns (result, state, (namespace names, bytes) of a notebook session or None)
+        self.conn.send((state, code, on_actions is not None, trace is not None, fresh, notebook, forget))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None and not self.conn.poll(max(deadline - time.monotonic(), 0)):
+                raise TimeoutError
+            message = self.conn.recv()
+            if message[0] == "batch":
+                on_actions(message[1])
+                continue
+            if trace is not None:
+                trace.spans.extend(message[3])
+            return message[1], message[2], message[4]
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.conn.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+
+class ThreadBackend:
+    name = "thread"
+    # notebook namespaces live in the executors here, so snapshots can copy them
+    local_namespaces = True
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    async def execute(self, executor: GameExecutor, code: str, on_actions=None, trace=None) -> dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, partial(executor.execute_player_code, code, on_actions, trace))
+
+    async def execute_batch(self, executor: GameExecutor, programs: list, fresh: bool = False, trace=None) -> list:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, partial(executor.execute_batch, programs, fresh, trace))
+
+    def reset_namespace(self, executor: GameExecutor):
+        executor.reset_namespace()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+class ProcessBackend:
+    name = "process"
+    local_namespaces = False
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # forkserver where there is one: a plain fork from the server would hand every worker copies of the
+        # open client sockets, and a closed connection stays half-open until the worker exits
+        methods = multiprocessing.get_all_start_methods()
+        self._ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+        self._idle = []
+        self._idle_changed = threading.Condition()
+        self._workers = []
+        self._started = False
+        self._start_lock = threading.Lock()
+        # notebook namespaces live in the worker that ran the session's first cell, so those sessions
+        # are pinned: executor -> [slot, worker, namespace key, finalizer]. namespaces of reset or
+        # collected executors are dropped with the next job sent to their worker
+        self._pins = weakref.WeakKeyDictionary()
+        self._forget = {}
+        self._next_slot = itertools.count()
+        # one dispatch thread per worker process, blocked on the pipe while it runs
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def start(self):
+        # workers are forked lazily so importing main.py (e.g. as __mp_main__ under spawn) never forks
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            for slot in range(self.max_workers):
+                worker = _Worker(self._ctx, slot)
+                self._workers.append(worker)
+                self._idle.append(worker)
+
+    def _acquire(self, slot: int = None) -> _Worker:
+        # any idle worker, or the one in `slot` for a pinned session (which waits for it even if others are idle)
+        with self._idle_changed:
+            while True:
+                if slot is None and self._idle:
+                    return self._idle.pop()
+                if slot is not None and self._workers[slot] in self._idle:
+                    worker = self._workers[slot]
+                    self._idle.remove(worker)
+                    return worker
+                self._idle_changed.wait()
+
+    def _release(self, worker: _Worker):
+        with self._idle_changed:
+            self._idle.append(worker)
+            self._idle_changed.notify_all()
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.process.kill()
+        worker.close()
+        fresh = _Worker(self._ctx, worker.slot)
+        self._workers[worker.slot] = fresh
+        with self._idle_changed:
+            # the namespaces went down with the old process
+            self._forget.pop(worker.slot, None)
+        return fresh
+
+    def _pin(self, executor: GameExecutor) -> list:
+        pin = self._pins.get(executor)
+        if pin is None:
+            slot = next(self._next_slot) % self.max_workers
+            key = uuid.uuid4().hex
+            pin = [slot, self._workers[slot], key, weakref.finalize(executor, self._forget_later, slot, key)]
+            self._pins[executor] = pin
+        return pin
+
+    def _forget_later(self, slot: int, key: str):
+        with self._idle_changed:
+            self._forget.setdefault(slot, []).append(key)
+
+    def reset_namespace(self, executor: GameExecutor):
+        executor.reset_namespace()
+        pin = self._pins.pop(executor, None)
+        if pin is not None:
+            # runs _forget_later once, now
+            pin[3]()
+
+    def _run(self, executor: GameExecutor, code: str, on_actions=None, trace=None) -> dict:
+        # memoization happens here in the parent so every worker shares one cache
+        if executor.result_cache is not None and not executor.notebook:
+            return executor.result_cache.execute(
+                executor, code, partial(self._dispatch, executor, on_actions=on_actions, trace=trace)
+            )
+        return self._dispatch(executor, code, on_actions, trace)
+
+    def _dispatch(self, executor: GameExecutor, code, on_actions=None, trace=None, fresh: bool = False):
+        # on a dispatch thread, starting the workers takes a while and must not hold up the event loop
+        self.start()
+        if trace is not None:
+            wait_start = time.perf_counter()
+        pin = self._pin(executor) if executor.notebook else None
+        worker = self._acquire(None if pin is None else pin[0])
+        if trace is not None:
+            trace.add("worker_wait", wait_start, time.perf_counter())
+        namespace_lost = pin is not None and pin[1] is not worker
+        if namespace_lost:
+            # the pinned worker was replaced since the last cell
+            pin[1] = worker
+            executor.reset_namespace()
+        with self._idle_changed:
+            forget = self._forget.pop(worker.slot, [])
+        # a batch gets the wall budget of all its programs together
+        runs = len(code) if isinstance(code, list) else 1
+        try:
+            result, state, namespace = worker.run(
+                executor.get_state(), code,
+                timeout=executor.budget.wall_time * runs + HARD_KILL_GRACE,
+                on_actions=on_actions,
+                trace=trace,
+                fresh=fresh,
+                notebook=None if pin is None else pin[2],
+                forget=forget
+            )
+        except TimeoutError:
+            # stuck outside the tick checks (e.g. a huge builtin call): kill it and reclaim the slot
+            worker = self._replace(worker)
+            error = BudgetExceeded("wall time", f"{executor.budget.wall_time}s")
+            results = [executor.budget_exceeded_result(error) for _ in (code if isinstance(code, list) else [code])]
+            if pin is not None:
+                pin[1] = worker
+                executor.reset_namespace()
+                for result in results:
+                    result["namespace_reset"] = True
+            return results if isinstance(code, list) else results[0]
+        except (EOFError, OSError):
+            worker = self._replace(worker)
+            if pin is not None:
+                pin[1] = worker
+                executor.reset_namespace()
+            raise RuntimeError("execution worker died")
+        finally:
+            self._release(worker)
+        executor.set_state(state)
+        if namespace is not None:
+            executor.namespace_names, executor.namespace_bytes = namespace
+        if namespace_lost:
+            for item in result if isinstance(result, list) else [result]:
+                item["namespace_reset"] = True
+        return result
+
+    async def execute(self, executor: GameExecutor, code: str, on_actions=None, trace=None) -> dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, partial(self._run, executor, code, on_actions, trace))
+
+    def execute_blocking(self, executor: GameExecutor, code: str, trace=None) -> dict:
+        # same path as execute() for callers without an event loop (grader.py), safe from many threads
+        return self._run(executor, code, None, trace)
+
+    async def execute_batch(self, executor: GameExecutor, programs: list, fresh: bool = False, trace=None) -> list:
+        # the whole batch is one job for one worker; it skips the result cache, which lives up here
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, partial(self._dispatch, executor, list(programs), None, trace, fresh))
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+        for worker in self._workers:
+            worker.close()
+        self._workers.clear()
+
+BACKENDS = {
+    "thread": ThreadBackend,
+    "process": ProcessBackend,
+}
+
+def make_backend(name: str = "process", max_workers: int = None):
+    if name not in BACKENDS:
+        raise ValueError(f"unknown execution backend: {name}")
+    if max_workers is None:
+        return BACKENDS[name]()
+    return BACKENDS[name](max_workers=max_workers)
@@ -0,0 +1,101 @@
+import ast
+from action_log import DELTAS, DOWN, LEFT, RIGHT, UP, ActionLog
+
+# programs made only of player.move_*() calls (constant steps or a loop variable), `for ... in
+# range(<constants>)` loops and `pass` are replayed from a precomputed action log instead of exec'd
+MOVE_METHODS = {"move_up": UP, "move_down": DOWN, "move_left": LEFT, "move_right": RIGHT}
+# longer programs go through exec, every cached plan keeps its whole log in memory
+FAST_PATH_MAX_ACTIONS = 1000
+# bounds the work spent expanding loops that produce no moves
+FAST_PATH_MAX_TICKS = 10 * FAST_PATH_MAX_ACTIONS
+
+class _Unsupported(Exception):
+    pass
+
+def _int_constant(node):
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return node.value
+    if (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub)
+            and isinstance(node.operand, ast.Constant) and type(node.operand.value) is int):
+        return -node.operand.value
+    raise _Unsupported
+
+def _range_args(node) -> tuple:
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "range"):
+        raise _Unsupported
+    if node.keywords or not 1 <= len(node.args) <= 3:
+        raise _Unsupported
+    args = tuple(_int_constant(arg) for arg in node.args)
+    if len(args) == 3 and args[2] == 0:
+        # range() raises, leave it to exec
+        raise _Unsupported
+    return args
+
+def _steps(call: ast.Call, variables: dict):
+    if len(call.args) + len(call.keywords) > 1:
+        raise _Unsupported
+    if call.keywords:
+        if call.keywords[0].arg != "steps":
+            raise _Unsupported
+        node = call.keywords[0].value
+    elif call.args:
+        node = call.args[0]
+    else:
+        return 1
+    if isinstance(node, ast.Name):
+        if node.id not in variables:
+            raise _Unsupported
+        steps = variables[node.id]
+    elif isinstance(node, ast.Constant):
+        steps = node.value
+    else:
+        steps = _int_constant(node)
+    # Player.move_* falls back to one step for anything that isn't a non-negative int
+    if not isinstance(steps, int) or steps < 0:
+        return 1
+    return int(steps)
+
+def _move(statement):
+    if not (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call)):
+        raise _Unsupported
+    call = statement.value
+    func = call.func
+    if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == "player"
+            and func.attr in MOVE_METHODS):
+        raise _Unsupported
+    return MOVE_METHODS[func.attr], call
+
+def _expand(statements: list, variables: dict, log: ActionLog, position: list, ticks: list):
+    for statement in statements:
+        if isinstance(statement, ast.Pass):
+            continue
+        if isinstance(statement, ast.For):
+            if (statement.orelse or not isinstance(statement.target, ast.Name)
+                    or statement.target.id in ("player", "range")):
+                raise _Unsupported
+            args = _range_args(statement.iter)
+            for value in range(*args):
+                ticks[0] += 1
+                if ticks[0] > FAST_PATH_MAX_TICKS:
+                    raise _Unsupported
+                _expand(statement.body, dict(variables, **{statement.target.id: value}), log, position, ticks)
+            continue
+        direction, call = _move(statement)
+        steps = _steps(call, variables)
+        log.append(direction, steps, position[0], position[1])
+        if len(log) > FAST_PATH_MAX_ACTIONS:
+            raise _Unsupported
+        dx, dy = DELTAS[direction]
+        position[0] += dx * steps
+        position[1] += dy * steps
+
+def recognize(tree: ast.Module):
+    # {"actions": log from (0, 0), "dx", "dy", "ticks"} when the whole program is in the subset, else None
+    log = ActionLog()
+    position = [0, 0]
+    ticks = [0]
+    try:
+        _expand(tree.body, {}, log, position, ticks)
+    except (_Unsupported, OverflowError, TypeError):
+        return None
+    return {"actions": log, "dx": position[0], "dy": position[1], "ticks": ticks[0]}
@@ -1,137 +1,345 @@
-import sys
-from io import StringIO
+import os
 import traceback
 import time
+from functools import partial
+from action_log import DOWN, LEFT, RIGHT, UP, ActionLog
+from analysis import analysis_cache
+from snapshots import Snapshot, SnapshotRing, copy_namespace
+from sandbox import (
+    DEFAULT_BUDGET, SANDBOX_NAMES, BudgetExceeded, BudgetMeter, ExecutionBudget, code_cache, make_globals_template,
+    namespace_nbytes, run_globals
+)
+
+MAX_OUTPUT_BYTES = 64 * 1024
+# streaming runs hand actions out every STREAM_BATCH_ACTIONS moves or STREAM_BATCH_INTERVAL seconds
+STREAM_BATCH_ACTIONS = 50
+STREAM_BATCH_INTERVAL = 0.05
+# moves kept across executions for reconnects and the session store
+HISTORY_LIMIT = 500
+# where a fresh Player starts, batches in "fresh" mode run every program from here
+FRESH_STATE = {"position": {"x": 0, "y": 0}}
+# rough fixed cost of an idle executor (player, meter, empty logs), used for memory accounting
+EXECUTOR_OVERHEAD = 2048
+# what a notebook session may keep defined between cells; past it the namespace is cleared
+NAMESPACE_MAX_BYTES = int(os.environ.get("NAMESPACE_MAX_BYTES", 1024 * 1024))
+# per-run names a notebook namespace doesn't keep between cells (the run's output sink and budget meter)
+RUN_NAMES = SANDBOX_NAMES - {"__builtins__", "player"}
+
+class OutputSink:
+    # per-execution replacement for sys.stdout; player code reaches it through an injected print
+    def __init__(self, max_bytes: int = MAX_OUTPUT_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.parts = []
+        self.truncated = False
+
+    def write(self, text):
+        if self.truncated:
+            return 0
+        text = str(text)
+        data = text.encode("utf-8", "replace")
+        if self.size + len(data) > self.max_bytes:
+            data = data[:self.max_bytes - self.size]
+            text = data.decode("utf-8", "ignore")
+            self.truncated = True
+        self.size += len(data)
+        self.parts.append(text)
+        return len(text)
+
+    def print(self, *args, sep=" ", end="\n", file=None, flush=False):
+        if sep is None:
+            sep = " "
+        if end is None:
+            end = "\n"
+        (file if file is not None else self).write(sep.join(map(str, args)) + end)
+
+    def getvalue(self) -> str:
+        output = "".join(self.parts)
+        if self.truncated:
+            output += f"\n[output truncated at {self.max_bytes} bytes]"
+        return output
 
 class Player:
+    # the only object player code gets; it must not lead back to the executor (budget meter, result
+    # cache, globals template), so it keeps just the recording callback under a name analysis refuses.
+    # slots keep it that way between runs: no new attributes and no rebound move methods, which the
+    # result cache and the fast path both rely on
+    __slots__ = ("_add_move", "position")
+
     def __init__(self, executor):
-        self.executor = executor
+        self._add_move = executor.add_move
         self.position = {"x": 0, "y": 0}
         
     def move_up(self, steps=1):
         if not isinstance(steps, int) or steps < 0:
             steps = 1
         
-        old_pos = self.position.copy()
-        self.position["y"] -= steps
-        
-        action = {
-            "type": "move",
-            "direction": "up",
-            "steps": steps,
-            "from": old_pos,
-            "to": self.position.copy()
-        }
-        
-        self.executor.add_action(action)
+        position = self.position
+        # the new coordinate first, a non-numeric one raises here before anything is recorded
+        y = position["y"] - steps
+        self._add_move(UP, steps, position["x"], position["y"])
+        position["y"] = y
         return f"Moved up {steps} steps"
     
     def move_down(self, steps=1):
         if not isinstance(steps, int) or steps < 0:
             steps = 1
         
-        old_pos = self.position.copy()
-        self.position["y"] += steps
-        
-        action = {
-            "type": "move", 
-            "direction": "down",
-            "steps": steps,
-            "from": old_pos,
-            "to": self.position.copy()
-        }
-        
-        self.executor.add_action(action)
+        position = self.position
+        y = position["y"] + steps
+        self._add_move(DOWN, steps, position["x"], position["y"])
+        position["y"] = y
         return f"Moved down {steps} steps"
     
     def move_left(self, steps=1):
         if not isinstance(steps, int) or steps < 0:
             steps = 1
         
-        old_pos = self.position.copy()
-        self.position["x"] -= steps
-        
-        action = {
-            "type": "move",
-            "direction": "left", 
-            "steps": steps,
-            "from": old_pos,
-            "to": self.position.copy()
-        }
-        
-        self.executor.add_action(action)
+        position = self.position
+        x = position["x"] - steps
+        self._add_move(LEFT, steps, position["x"], position["y"])
+        position["x"] = x
         return f"Moved left {steps} steps"
     
     def move_right(self, steps=1):
         if not isinstance(steps, int) or steps < 0:
             steps = 1
         
-        old_pos = self.position.copy()
-        self.position["x"] += steps
-        
-        action = {
-            "type": "move",
-            "direction": "right",
-            "steps": steps, 
-            "from": old_pos,
-            "to": self.position.copy()
-        }
-        
-        self.executor.add_action(action)
+        position = self.position
+        x = position["x"] + steps
+        self._add_move(RIGHT, steps, position["x"], position["y"])
+        position["x"] = x
         return f"Moved right {steps} steps"
 
 class GameExecutor:
-    def __init__(self):
+    def __init__(self, budget: ExecutionBudget = DEFAULT_BUDGET, result_cache=None):
         self.player = Player(self)
-        self.actions = []
+        self.globals_template = make_globals_template(self.player)
+        self.actions = ActionLog()
+        self.history = ActionLog()
+        # set while a snapshot holds the history log, the next append copies it first
+        self.history_shared = False
+        self.snapshots = SnapshotRing()
+        self.budget = budget
+        self.meter = None
+        # optional shared ResultCache; only safe because player code can't reach it: all it gets is the
+        # player, and analysis refuses the player's underscore attributes
+        self.result_cache = result_cache
+        # straight-line move programs skip exec (fast_path.py); off only to compare against exec
+        self.fast_path = True
+        self.on_actions = None
+        self.streamed = 0
+        self.last_flush = 0.0
+        # notebook mode: every run is a cell against one persistent namespace instead of a fresh one;
+        # names and bytes are kept here too, the namespace itself may live in a worker process
+        self.notebook = False
+        self.namespace = None
+        self.namespace_names = frozenset()
+        self.namespace_bytes = 0
+        self.namespace_limit = NAMESPACE_MAX_BYTES
         
-    def add_action(self, action):
-        self.actions.append(action)
+    def add_move(self, direction: int, steps: int, x: int, y: int):
+        # budget is checked before the player's position changes
+        if self.meter is not None:
+            self.meter.check_actions(len(self.actions))
+        self.actions.append(direction, steps, x, y)
+        if self.on_actions is not None and (
+            len(self.actions) - self.streamed >= STREAM_BATCH_ACTIONS
+            or time.perf_counter() - self.last_flush >= STREAM_BATCH_INTERVAL
+        ):
+            self.flush_actions()
+
+    def flush_actions(self):
+        # called on the executing thread; the callback gets its own copy of the new actions
+        if len(self.actions) > self.streamed:
+            batch = self.actions.slice(self.streamed, len(self.actions))
+            self.streamed = len(self.actions)
+            self.on_actions(batch)
+        self.last_flush = time.perf_counter()
+        if self.meter is not None:
+            self.meter.flush_at = self.last_flush + STREAM_BATCH_INTERVAL
+
+    def get_state(self) -> dict:
+        return {"position": self.player.position.copy()}
+
+    def set_state(self, state: dict):
+        self.player.position = dict(state["position"])
+
+    def record_history(self, result: dict):
+        actions = result.get("actions")
+        if isinstance(actions, ActionLog) and len(actions):
+            if self.history_shared:
+                self.history = self.history.slice(0, len(self.history))
+                self.history_shared = False
+            self.history.extend(actions, HISTORY_LIMIT)
+
+    def export_session(self) -> dict:
+        # JSON-friendly record for session stores; a notebook namespace can't be stored, only the mode is
+        return {
+            "position": self.player.position.copy(),
+            "history": self.history.to_runs(),
+            "notebook": self.notebook,
+            "snapshots": self.snapshots.export()
+        }
+
+    def import_session(self, record: dict):
+        self.player.position = dict(record["position"])
+        self.history = ActionLog.from_runs(record["history"])
+        self.history_shared = False
+        self.notebook = record.get("notebook", False)
+        self.snapshots = SnapshotRing.load(record.get("snapshots", []))
+
+    def nbytes(self) -> int:
+        history = 0 if self.history_shared else self.history.nbytes()
+        return EXECUTOR_OVERHEAD + history + self.actions.nbytes() + self.namespace_bytes + self.snapshots.nbytes()
+
+    def take_snapshot(self, name: str = None, namespace: bool = False) -> Snapshot:
+        # position and history cost nothing to keep, only a notebook namespace is copied
+        copied = None
+        if namespace and self.namespace is not None:
+            copied = copy_namespace(self.namespace, self.player)
+        self.history_shared = True
+        snapshot = Snapshot(
+            name or self.snapshots.next_name(), self.player.position.copy(), self.history,
+            copied, self.namespace_bytes if copied is not None else 0
+        )
+        self.snapshots.add(snapshot)
+        return snapshot
+
+    def restore_snapshot(self, name: str):
+        # None when there's no such snapshot; a snapshot without a namespace leaves the current one alone
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            return None
+        self.player.position = snapshot.position.copy()
+        self.history = snapshot.history
+        self.history_shared = True
+        self.actions = ActionLog()
+        if snapshot.namespace is not None:
+            # refilled in place, functions defined by earlier cells hold this very dict as their globals
+            namespace = self.notebook_globals()
+            for variable in [variable for variable in namespace if variable not in SANDBOX_NAMES]:
+                del namespace[variable]
+            namespace.update(copy_namespace(snapshot.namespace, self.player))
+            self.namespace_names = frozenset(snapshot.namespace)
+            self.namespace_bytes = snapshot.namespace_bytes
+        return snapshot
+
+    def notebook_globals(self) -> dict:
+        if self.namespace is None:
+            self.namespace = run_globals(self.globals_template)
+        # an earlier cell may have rebound `player`
+        self.namespace["player"] = self.player
+        return self.namespace
+
+    def reset_namespace(self):
+        self.namespace = None
+        self.namespace_names = frozenset()
+        self.namespace_bytes = 0
+
+    def settle_namespace(self, result: dict):
+        # after every cell, failed ones included (whatever they assigned before failing stays, like a notebook)
+        namespace = self.namespace
+        if namespace is None:
+            return
+        for name in RUN_NAMES:
+            namespace.pop(name, None)
+        size = namespace_nbytes(namespace, self.namespace_limit)
+        if size > self.namespace_limit:
+            self.reset_namespace()
+            result["namespace_reset"] = True
+            if result["success"]:
+                result.update(
+                    success=False,
+                    error=f"NamespaceLimit: variables use more than {self.namespace_limit} bytes, the namespace was cleared",
+                    error_type="namespace_limit"
+                )
+            return
+        self.namespace_bytes = size
+        self.namespace_names = frozenset(name for name in namespace if name not in SANDBOX_NAMES)
+
+    def compact(self):
+        # the last run's actions were already sent, only history is needed to resume
+        self.actions = ActionLog()
     
-    def execute_player_code(self, code: str) -> dict:
-        self.actions.clear()
+    def execute_player_code(self, code: str, on_actions=None, trace=None) -> dict:
+        # a cell's result depends on the namespace, only scripts can be shared
+        if self.result_cache is not None and not self.notebook:
+            return self.result_cache.execute(self, code, partial(self._execute, on_actions=on_actions, trace=trace))
+        return self._execute(code, on_actions, trace)
+
+    def execute_batch(self, programs: list, fresh: bool = False, trace=None) -> list:
+        # sequential runs continue from each other, fresh ones start over and leave the position untouched
+        saved = self.get_state() if fresh else None
+        results = []
+        try:
+            for code in programs:
+                if fresh:
+                    self.set_state(FRESH_STATE)
+                results.append(self.execute_player_code(code, trace=trace))
+        finally:
+            if fresh:
+                self.set_state(saved)
+        return results
+
+    def _execute(self, code: str, on_actions=None, trace=None) -> dict:
+        verdict, plan = analysis_cache.inspect(
+            code, self.budget.max_ticks, self.budget.max_actions, self.namespace_names if self.notebook else None
+        )
+        if verdict is not None:
+            return self.rejected_result(verdict)
+        self.on_actions = on_actions
+        self.streamed = 0
+        self.last_flush = time.perf_counter()
+        position = self.player.position
+        # float positions would round differently when shifted in one step, those stay on exec; so do
+        # notebook cells, a plan neither binds its loop variables nor sees a rebound `player`
+        if (self.fast_path and plan is not None and not self.notebook
+                and type(position["x"]) is int and type(position["y"]) is int):
+            return self._run_plan(plan, trace)
+        self.actions = ActionLog()
         
         execution_result = {
             "success": True,
             "output": "",
             "error": "",
-            "actions": [],
+            "actions": ActionLog(),
             "player_position": self.player.position.copy(),
             "execution_time": 0.0,
             "valid_commands": 0
         }
         
-        old_stdout = sys.stdout
-        captured_output = StringIO()
-        sys.stdout = captured_output
+        captured_output = OutputSink()
+        meter = BudgetMeter(self.budget)
+        self.meter = meter
+        if on_actions is not None:
+            meter.flush = self.flush_actions
+            meter.flush_at = self.last_flush + STREAM_BATCH_INTERVAL
         
         try:
             start_time = time.time()
+            if trace is not None:
+                stage_start = time.perf_counter()
+            
+            compiled = code_cache.compile(code)
+            if trace is not None:
+                stage_end = time.perf_counter()
+                trace.add("compile", stage_start, stage_end)
+                stage_start = stage_end
+            
+            safe_globals = self.notebook_globals() if self.notebook else run_globals(self.globals_template)
+            safe_globals['print'] = captured_output.print
+            safe_globals.update(meter.namespace())
             
-            safe_globals = {
-                '__builtins__': {
-                    'range': range,
-                    'len': len,
-                    'int': int,
-                    'str': str,
-                    'float': float,
-                    'bool': bool,
-                    'list': list,
-                    'dict': dict,
-                    'tuple': tuple,
-                    'min': min,
-                    'max': max,
-                    'abs': abs,
-                    'sum': sum,
-                    'enumerate': enumerate,
-                    'zip': zip,
-                },
-                'player': self.player
-            }
+            # a cell's top-level names go straight into the namespace, so functions from earlier cells see them
+            safe_locals = safe_globals if self.notebook else {}
             
-            safe_locals = {}
+            exec(compiled, safe_globals, safe_locals)
             
-            exec(code, safe_globals, safe_locals)
+            if meter.exceeded is not None:
+                raise meter.exceeded
+            if trace is not None:
+                trace.add("exec", stage_start, time.perf_counter())
             
             execution_time = time.time() - start_time
             
@@ -139,7 +347,8 @@ class GameExecutor:
             
             execution_result.update({
                 "output": output,
-                "actions": self.actions.copy(),
+                # the result takes the log over, the next run starts a fresh one
+                "actions": self.actions,
                 "player_position": self.player.position.copy(),
                 "execution_time": execution_time,
                 "valid_commands": len(self.actions)
@@ -149,21 +358,84 @@ class GameExecutor:
             execution_result.update({
                 "success": False,
                 "error": f"Syntax Error: {str(e)}",
+                "error_type": "syntax_error",
                 "error_line": e.lineno - 1 if e.lineno else 0,
                 "traceback": f"Line {e.lineno}: {e.text.strip() if e.text else ''}"
             })
             
-        except Exception as e:
+        except (Exception, BudgetExceeded) as e:
+            # a budget error swallowed by player code still wins over whatever it raised next
+            if meter.exceeded is not None:
+                e = meter.exceeded
             error_msg = f"{type(e).__name__}: {str(e)}"
             traceback_str = traceback.format_exc()
             
             execution_result.update({
                 "success": False,
                 "error": error_msg,
+                "error_type": "budget_exceeded" if isinstance(e, BudgetExceeded) else "runtime_error",
                 "traceback": traceback_str
             })
             
         finally:
-            sys.stdout = old_stdout
+            self.meter = None
+            if self.on_actions is not None:
+                self.flush_actions()
+                self.on_actions = None
+        
+        if self.notebook:
+            self.settle_namespace(execution_result)
             
-        return execution_result
\ No newline at end of file
+        return execution_result
+
+    def _run_plan(self, plan: dict, trace=None) -> dict:
+        start_time = time.time()
+        if trace is not None:
+            stage_start = time.perf_counter()
+        position = self.player.position
+        # the plan's log is shared, nothing appends to a finished run's actions
+        self.actions = plan["actions"].translated(position["x"], position["y"])
+        position["x"] += plan["dx"]
+        position["y"] += plan["dy"]
+        if self.on_actions is not None:
+            self.flush_actions()
+            self.on_actions = None
+        if trace is not None:
+            trace.add("fast_path", stage_start, time.perf_counter())
+        return {
+            "success": True,
+            "output": "",
+            "error": "",
+            "actions": self.actions,
+            "player_position": position.copy(),
+            "execution_time": time.time() - start_time,
+            "valid_commands": len(self.actions)
+        }
+
+    def rejected_result(self, verdict: dict) -> dict:
+        # a program turned down by static analysis, shaped like any other failed run
+        return {
+            "success": False,
+            "output": "",
+            "error": verdict["error"],
+            "error_type": verdict["error_type"],
+            "error_line": verdict["line"] - 1,
+            "traceback": f"Line {verdict['line']}: {verdict['text']}",
+            "actions": ActionLog(),
+            "player_position": self.player.position.copy(),
+            "execution_time": 0.0,
+            "valid_commands": 0
+        }
+
+    def budget_exceeded_result(self, error: BudgetExceeded) -> dict:
+        # used by backends that preempt a run from outside the executor
+        return {
+            "success": False,
+            "output": "",
+            "error": f"{type(error).__name__}: {str(error)}",
+            "error_type": "budget_exceeded",
+            "actions": ActionLog(),
+            "player_position": self.player.position.copy(),
+            "execution_time": self.budget.wall_time,
+            "valid_commands": 0
+        }
\ No newline at end of file
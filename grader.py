@@ -0,0 +1,222 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import statistics
+import sys
+import time
+from game_executor import GameExecutor
+from execution_backend import ProcessBackend
+from result_cache import ResultCache
+
+# offline grading: JSONL submissions in, JSONL results out, no server involved
+#
+#   python grader.py submissions.jsonl results.jsonl --workers 8
+#
+# every input line is {"id": ..., "code": "...", "target": {"x": .., "y": ..}, "start": {"x": .., "y": ..}};
+# only "code" is required, "id" defaults to the line number. rerunning with --resume skips ids
+# that already have a result in the output file and appends the rest. results are written in
+# completion order, not input order. a line that isn't a usable submission gets a result with
+# error_type "invalid_submission" and grading goes on
+
+PROGRESS_INTERVAL = 5.0
+
+def submission_error(submission) -> str:
+    # None for a usable submission, otherwise what's wrong with it
+    if not isinstance(submission, dict):
+        return "submission must be a JSON object"
+    if not isinstance(submission.get("id", 0), (str, int)):
+        return "id must be a string or a number"
+    if not isinstance(submission.get("code"), str):
+        return "code must be a string"
+    for field in ("target", "start"):
+        value = submission.get(field)
+        if value is not None and not (isinstance(value, dict) and "x" in value and "y" in value):
+            return f"{field} must be an object with x and y"
+    return None
+
+def load_submissions(path: str):
+    # yields submissions, and {"id": .., "invalid": reason} for lines that aren't one
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                submission = json.loads(line)
+            except ValueError as e:
+                yield {"id": line_number, "invalid": f"invalid JSON: {e}"}
+                continue
+            error = submission_error(submission)
+            if error is not None:
+                valid_id = isinstance(submission, dict) and isinstance(submission.get("id"), (str, int))
+                yield {"id": submission["id"] if valid_id else line_number, "invalid": error}
+                continue
+            submission.setdefault("id", line_number)
+            yield submission
+
+def invalid_record(submission_id, error: str) -> dict:
+    return {
+        "id": submission_id,
+        "success": False,
+        "passed": None,
+        "player_position": None,
+        "target": None,
+        "valid_commands": 0,
+        "execution_time": 0.0,
+        "output": "",
+        "error": error,
+        "error_type": "invalid_submission"
+    }
+
+def completed_ids(path: str) -> set:
+    # ids already graded in `path`; a half-written last line from an interrupted run is cut off
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    for line in data.splitlines():
+        try:
+            done.add(json.loads(line)["id"])
+        except (ValueError, KeyError):
+            continue
+    return done
+
+def grade(backend, submission: dict, result_cache=None, keep_actions: bool = False) -> dict:
+    executor = GameExecutor(result_cache=result_cache)
+    if submission.get("start"):
+        executor.player.position = {"x": submission["start"]["x"], "y": submission["start"]["y"]}
+    try:
+        result = backend.execute_blocking(executor, submission["code"])
+    except Exception as e:
+        # a dead worker fails this submission, not the whole run
+        result = dict(executor.budget_exceeded_result(e), error=str(e), error_type="internal", execution_time=0.0)
+    try:
+        target = submission.get("target")
+        position = result["player_position"]
+        record = {
+            "id": submission["id"],
+            "success": result["success"],
+            "passed": None if target is None else (
+                result["success"] and position["x"] == target["x"] and position["y"] == target["y"]
+            ),
+            "player_position": position,
+            "target": target,
+            "valid_commands": result["valid_commands"],
+            "execution_time": result["execution_time"],
+            "output": result["output"],
+            "error": result["error"],
+            "error_type": result.get("error_type")
+        }
+        if keep_actions:
+            record["actions"] = result["actions"].to_runs()
+    except Exception as e:
+        # anything submission_error didn't catch still only fails this one
+        return invalid_record(submission.get("id"), f"{type(e).__name__}: {e}")
+    return record
+
+def grade_file(input_path: str, output_path: str, workers: int = None, resume: bool = False,
+               use_cache: bool = False, keep_actions: bool = False, progress=None) -> dict:
+    backend = ProcessBackend(max_workers=workers)
+    backend.start()
+    result_cache = ResultCache() if use_cache else None
+    skip = completed_ids(output_path) if resume else set()
+    summary = {"graded": 0, "skipped": 0, "passed": 0, "failed": 0, "errors": {}}
+    execution_times = []
+    start_time = time.time()
+    last_report = start_time
+
+    def report(final: bool = False):
+        elapsed = time.time() - start_time
+        summary["elapsed"] = elapsed
+        summary["throughput"] = summary["graded"] / elapsed if elapsed > 0 else 0.0
+        if progress is not None:
+            progress(summary, final)
+
+    # submissions are read lazily and at most a few per worker are in flight, so input size doesn't matter
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=backend.max_workers)
+    in_flight = set()
+    try:
+        with open(output_path, "a" if resume else "w") as out:
+
+            def write(record: dict):
+                out.write(json.dumps(record) + "\n")
+                summary["graded"] += 1
+                if record["passed"]:
+                    summary["passed"] += 1
+                elif record["passed"] is False:
+                    summary["failed"] += 1
+                if not record["success"]:
+                    summary["errors"][record["error_type"]] = summary["errors"].get(record["error_type"], 0) + 1
+                if record["error_type"] != "invalid_submission":
+                    execution_times.append(record["execution_time"])
+
+            def collect(done):
+                nonlocal last_report
+                for future in done:
+                    write(future.result())
+                if time.time() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.time()
+                    out.flush()
+                    report()
+
+            for submission in load_submissions(input_path):
+                if submission["id"] in skip:
+                    summary["skipped"] += 1
+                    continue
+                if "invalid" in submission:
+                    write(invalid_record(submission["id"], submission["invalid"]))
+                    continue
+                in_flight.add(pool.submit(grade, backend, submission, result_cache, keep_actions))
+                if len(in_flight) >= backend.max_workers * 4:
+                    done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect(done)
+            collect(concurrent.futures.wait(in_flight).done)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        backend.shutdown()
+
+    if execution_times:
+        execution_times.sort()
+        summary["execution_time_p50"] = statistics.median(execution_times)
+        summary["execution_time_p95"] = execution_times[int(0.95 * (len(execution_times) - 1))]
+    if result_cache is not None:
+        summary["cache"] = result_cache.stats()
+    report(final=True)
+    return summary
+
+def print_progress(summary: dict, final: bool = False):
+    line = (
+        f"graded {summary['graded']} (skipped {summary['skipped']}) | "
+        f"passed {summary['passed']} failed {summary['failed']} | "
+        f"{summary['throughput']:.1f}/s in {summary['elapsed']:.1f}s"
+    )
+    if final and summary["errors"]:
+        line += " | errors " + ", ".join(f"{kind}: {count}" for kind, count in sorted(summary["errors"].items()))
+    print(line, file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="grade stored submissions offline")
+    parser.add_argument("input", help="submissions, one JSON object per line")
+    parser.add_argument("output", help="results, one JSON object per line")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--resume", action="store_true", help="skip ids already in the output file and append")
+    parser.add_argument("--cache", action="store_true", help="share results between identical submissions")
+    parser.add_argument("--actions", action="store_true", help="include the rle action log in every result")
+    args = parser.parse_args()
+
+    summary = grade_file(
+        args.input, args.output,
+        workers=args.workers,
+        resume=args.resume,
+        use_cache=args.cache,
+        keep_actions=args.actions,
+        progress=print_progress
+    )
+    print(json.dumps(summary), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,35 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import json
+from fastapi.responses import PlainTextResponse
 import asyncio
-from game_executor import GameExecutor
+from game_executor import ActionLog, GameExecutor
+from analysis import analysis_cache
+from execution_backend import make_backend
+from result_cache import ResultCache
+from serialization import get_serializer
+from admission import AdmissionController
+from metrics import Registry
+from tracing import tracer_from_env
+from session_store import default_store_spec, make_session_store
+from session_holding import holding_area_from_env, new_resume_token, token_digest, token_matches
+from session_registry import SWEEP_INTERVAL, session_registry_from_env
+from snapshots import SNAPSHOT_NAME_MAX
+from contextlib import asynccontextmanager
 from typing import Dict
 import uuid
-from functools import partial
+import os
+import socket
+import time
 import concurrent.futures
+from functools import partial
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(manager.run_sweeper())
+    yield
+    sweeper.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,67 +39,622 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# "verbose" is the original per-move list, "rle" is ActionLog.to_runs(); clients pick one with ?actions_format=
+ACTIONS_FORMATS = ("verbose", "rle")
+# ?frames=binary gets the serialized bytes as binary frames, skipping the decode/encode round trip
+FRAME_TYPES = ("text", "binary")
+# ?mode=notebook keeps the variables of every run for the next one, each submission is a new cell
+MODES = ("script", "notebook")
+DEFAULT_OPTIONS = {"actions_format": "verbose", "frames": "text", "mode": "script"}
+# messages carrying at least this many actions are formatted and serialized off the event loop
+OFFLOOP_ACTIONS = 256
+# execute_batch limits: programs per batch and total source size
+BATCH_MAX_PROGRAMS = int(os.environ.get("BATCH_MAX_PROGRAMS", 50))
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", 256 * 1024))
+BATCH_MODES = ("sequential", "fresh")
+# largest single program; parsing one is CPU-bound and holds the GIL, ~80ms at 64 KiB
+CODE_MAX_BYTES = int(os.environ.get("CODE_MAX_BYTES", 64 * 1024))
+# WORKERS > 1 runs several uvicorn worker processes; sessions then live in a shared SESSION_STORE
+WORKERS = int(os.environ.get("WORKERS", 1))
+
+def format_result(result: dict, actions_format: str) -> dict:
+    if isinstance(result.get("results"), list):
+        return dict(result, results=[format_result(item, actions_format) for item in result["results"]])
+    if actions_format == "rle" and isinstance(result.get("actions"), ActionLog):
+        return dict(result, actions=result["actions"].to_runs())
+    return result
+
+def action_count(message: dict) -> int:
+    data = message.get("data")
+    if isinstance(data, dict) and isinstance(data.get("results"), list):
+        return sum(action_count({"data": item}) for item in data["results"])
+    if isinstance(data, dict) and isinstance(data.get("actions"), ActionLog):
+        return len(data["actions"])
+    return 0
+
+def parse_batch(message: dict):
+    # (batch, None) or (None, error)
+    programs = message.get("programs")
+    mode = message.get("mode", "sequential")
+    if not isinstance(programs, list) or not all(isinstance(code, str) for code in programs):
+        return None, "programs must be a list of strings"
+    if mode not in BATCH_MODES:
+        return None, f"mode must be one of {', '.join(BATCH_MODES)}"
+    if not programs:
+        return None, "empty batch"
+    if len(programs) > BATCH_MAX_PROGRAMS:
+        return None, f"batch too large: {len(programs)} programs, max {BATCH_MAX_PROGRAMS}"
+    sizes = [len(code.encode()) for code in programs]
+    if sum(sizes) > BATCH_MAX_BYTES:
+        return None, f"batch too large: {sum(sizes)} bytes, max {BATCH_MAX_BYTES}"
+    if max(sizes) > CODE_MAX_BYTES:
+        return None, f"program too large: {max(sizes)} bytes, max {CODE_MAX_BYTES}"
+    return {"programs": programs, "fresh": mode == "fresh", "mode": mode}, None
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
         self.game_sessions: Dict[str, GameExecutor] = {}
+        self.connection_options: Dict[str, dict] = {}
+        # digests of the resume tokens handed out in `connected`, per live session
+        self.resume_tokens: Dict[str, str] = {}
+        # executors of dropped connections wait here for a `resume` (HOLD_TTL, HOLD_MAX_SESSIONS, HOLD_MAX_BYTES)
+        self.holding = holding_area_from_env()
+        # per-session size and last activity; idle sessions are compacted, then closed, and the whole lot
+        # (held sessions included) is kept under SESSION_MEMORY_BUDGET
+        self.registry = session_registry_from_env()
+        self.sweep_interval = float(os.environ.get("SWEEP_INTERVAL", SWEEP_INTERVAL))
         self.connection_lock = asyncio.Lock()
-        self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        # player code runs in worker processes (one per core by default), which are killed and replaced when
+        # stuck where ticks can't reach; EXECUTION_BACKEND=thread runs it in threads of this process, where a
+        # long builtin call holds the GIL and stalls every connection
+        workers = os.environ.get("EXECUTION_WORKERS")
+        self.backend = make_backend(
+            os.environ.get("EXECUTION_BACKEND", "process"),
+            int(workers) if workers else None
+        )
+        # RESULT_CACHE=1 shares finished runs between sessions, repeats of the same program cost one execution
+        self.result_cache = ResultCache() if os.environ.get("RESULT_CACHE") == "1" else None
+        self.serializer = get_serializer()
+        # ADMISSION_QUEUE bounds how many submissions may wait for a worker before clients get `busy`
+        self.admission = AdmissionController(
+            self.backend.max_workers,
+            int(os.environ.get("ADMISSION_QUEUE", 1000))
+        )
+        self.submissions: Dict[str, asyncio.Task] = {}
+        # sessions are pinned to the worker holding their socket; the store records that owner and
+        # the position/history a reconnect to any worker continues from
+        self.store = make_session_store(default_store_spec(WORKERS))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # TRACE_SAMPLE_RATE > 0 turns on per-stage span sampling, see /admin/traces and TRACE_FILE
+        self.tracer = tracer_from_env()
+        self.metrics = Registry()
+        self.queue_wait = self.metrics.histogram("game_queue_wait_seconds", "Time from admission until a worker slot frees up")
+        self.exec_time = self.metrics.histogram("game_exec_seconds", "Time spent executing player code, dispatch included")
+        self.send_time = self.metrics.histogram("game_send_seconds", "Time spent serializing and sending execution results")
+        self.executions = self.metrics.counter("game_executions_total", "Finished executions")
+        self.errors = self.metrics.counter("game_execution_errors_total", "Failed executions by error type")
+        self.rejections = self.metrics.counter("game_admission_rejections_total", "Submissions answered with busy, by reason")
+        self.evictions = self.metrics.counter("game_session_evictions_total", "Live sessions closed by the server, by reason")
+        self.metrics.counter_func("game_session_compactions_total", "Idle sessions compacted", lambda: self.registry.compactions)
+        self.metrics.counter_func("game_held_sessions_expired_total", "Held sessions dropped after HOLD_TTL", lambda: self.holding.expired)
+        self.metrics.counter_func("game_held_sessions_evicted_total", "Held sessions dropped to stay within limits", lambda: self.holding.evicted)
+        self.metrics.gauge("game_active_connections", "Open WebSocket connections", lambda: len(self.active_connections))
+        self.metrics.gauge("game_sessions", "Live game sessions", lambda: len(self.game_sessions))
+        self.metrics.gauge("game_session_bytes", "Estimated memory held by live sessions", lambda: self.registry.bytes)
+        self.metrics.gauge("game_session_memory_budget_bytes", "SESSION_MEMORY_BUDGET", lambda: self.registry.memory_budget)
+        self.metrics.gauge("game_held_sessions", "Dropped sessions waiting to be resumed", lambda: len(self.holding))
+        self.metrics.gauge("game_held_session_bytes", "Estimated memory held by dropped sessions", lambda: self.holding.bytes)
+        self.metrics.gauge("game_session_store_bytes", "Estimated memory held by the in-memory session store", lambda: self.store.bytes)
+        self.metrics.counter_func("game_session_store_evicted_total", "Stored sessions dropped to stay within limits", lambda: self.store.evicted)
+        self.metrics.gauge("game_pool_busy_workers", "Execution slots currently in use", lambda: self.admission.running)
+        self.metrics.gauge("game_pool_workers", "Execution slots available in total", lambda: self.admission.max_running)
+        self.metrics.gauge("game_queue_length", "Submissions waiting for an execution slot", lambda: len(self.admission.waiters))
+        self.serialize_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
     
+    async def store_call(self, method, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
     async def connect(self, websocket: WebSocket) -> str:
         await websocket.accept()
+        options = self.negotiate_options(websocket)
+        # ?session_id=&resume_token= continues a dropped session, whichever worker served it before
+        requested = websocket.query_params.get("session_id")
+        token = websocket.query_params.get("resume_token")
+        executor = None
+        if requested:
+            executor, source = await self.restore(requested, token)
+            if executor is None:
+                options["resume_error"] = source
+        options["resumed"] = executor is not None
+        if executor is None:
+            executor, token = GameExecutor(result_cache=self.result_cache), new_resume_token()
+            executor.notebook = options["mode"] == "notebook"
+        # a resumed session keeps the mode it started with
+        options["mode"] = "notebook" if executor.notebook else "script"
+        options["resume_token"] = token
         async with self.connection_lock:
-            session_id = str(uuid.uuid4())
-            self.active_connections[session_id] = websocket
-            self.game_sessions[session_id] = GameExecutor()
+            session_id = requested if options["resumed"] else str(uuid.uuid4())
+            self.register(session_id, websocket, executor, options, token)
         return session_id
+
+    def register(self, session_id: str, websocket: WebSocket, executor: GameExecutor, options: dict, token: str):
+        self.active_connections[session_id] = websocket
+        self.game_sessions[session_id] = executor
+        self.connection_options[session_id] = options
+        self.resume_tokens[session_id] = token_digest(token)
+        self.registry.add(session_id, executor)
+
+    async def restore(self, session_id: str, token: str):
+        # (executor, "memory" | "store") or (None, reason); a held executor is used as is, no replay needed
+        if not token:
+            return None, "missing_token"
+        if session_id in self.active_connections:
+            return None, "active"
+        if session_id in self.admission.in_flight:
+            # its last run is still executing
+            return None, "busy"
+        executor = self.holding.take(session_id, token)
+        entry = None
+        if executor is None or self.store.shared:
+            entry = await self.store_call(self.store.load, session_id)
+        # with a shared store another worker may have taken the session over since, its copy is newer
+        if executor is not None and (entry is None or entry["owner"] == self.worker_id):
+            return executor, "memory"
+        if entry is None or not token_matches(token, entry["record"].get("token_digest")):
+            return None, "not_found"
+        claimed = await self.store_call(self.store.claim, session_id, self.worker_id)
+        if claimed is None:
+            return None, "not_found"
+        executor = GameExecutor(result_cache=self.result_cache)
+        executor.import_session(claimed["record"])
+        return executor, "store"
+
+    async def resume(self, session_id: str, websocket: WebSocket, requested: str, token: str) -> str:
+        # swaps this connection over to a dropped session, returns the session id now in use
+        options = self.connection_options[session_id]
+        if session_id in self.submissions:
+            executor, source = None, "busy"
+        elif requested == session_id:
+            executor, source = None, "active"
+        else:
+            executor, source = await self.restore(requested, token)
+        if executor is None:
+            await self.send_message(websocket, {"type": "resume_failed", "session_id": requested, "reason": source}, options)
+            return session_id
+        async with self.connection_lock:
+            # the session this connection started with is parked too, unless it never ran anything
+            self.disconnect(session_id, hold=len(self.game_sessions[session_id].history) > 0)
+            options = dict(options, resumed=True, resume_token=token, mode="notebook" if executor.notebook else "script")
+            options.pop("resume_error", None)
+            self.register(requested, websocket, executor, options, token)
+        await self.send_message(websocket, {
+            "type": "resumed",
+            "session_id": requested,
+            "source": source,
+            "mode": options["mode"],
+            "player_position": executor.player.position
+        }, options)
+        return requested
+
+    async def reset_namespace(self, session_id: str, websocket: WebSocket):
+        # clears a notebook session's variables; the player stays where it is
+        options = self.connection_options[session_id]
+        executor = self.game_sessions[session_id]
+        if session_id in self.submissions:
+            message = {"type": "reset", "success": False, "reason": "busy"}
+        else:
+            self.backend.reset_namespace(executor)
+            self.registry.measure(session_id)
+            message = {"type": "reset", "success": True, "player_position": executor.player.position}
+        await self.send_message(websocket, message, options)
+
+    async def snapshot(self, session_id: str, websocket: WebSocket, name, namespace: bool = False):
+        # saves the player position, history and (notebook sessions on the thread backend) variables under `name`
+        options = self.connection_options[session_id]
+        executor = self.game_sessions[session_id]
+        if name is not None and (not isinstance(name, str) or not name or len(name) > SNAPSHOT_NAME_MAX):
+            message = {"type": "snapshot", "success": False, "reason": "invalid_name"}
+        elif session_id in self.submissions:
+            # a run in progress is still moving the player
+            message = {"type": "snapshot", "success": False, "reason": "busy"}
+        else:
+            snapshot = executor.take_snapshot(name, namespace and executor.notebook and self.backend.local_namespaces)
+            await self.finish_state_change(session_id, executor)
+            message = dict(snapshot.info(), type="snapshot", success=True, snapshots=executor.snapshots.names())
+        await self.send_message(websocket, message, options)
+
+    async def restore_snapshot(self, session_id: str, websocket: WebSocket, name):
+        options = self.connection_options[session_id]
+        executor = self.game_sessions[session_id]
+        if session_id in self.submissions:
+            message = {"type": "restore", "success": False, "reason": "busy"}
+        else:
+            snapshot = executor.restore_snapshot(name) if isinstance(name, str) else None
+            if snapshot is None:
+                message = {"type": "restore", "success": False, "reason": "not_found", "name": name}
+            else:
+                await self.finish_state_change(session_id, executor)
+                message = dict(snapshot.info(), type="restore", success=True, snapshots=executor.snapshots.names())
+        await self.send_message(websocket, message, options)
+
+    async def finish_state_change(self, session_id: str, executor: GameExecutor):
+        await self.finish_execution(session_id, executor, self.resume_tokens.get(session_id), [])
+
+    async def persist(self, session_id: str, executor: GameExecutor, digest: str):
+        record = executor.export_session()
+        record["token_digest"] = digest
+        await self.store_call(self.store.save, session_id, record, self.worker_id)
     
-    def disconnect(self, session_id: str):
+    def disconnect(self, session_id: str, hold: bool = True):
         if session_id in self.active_connections:
             del self.active_connections[session_id]
-        if session_id in self.game_sessions:
-            del self.game_sessions[session_id]
+        executor = self.game_sessions.pop(session_id, None)
+        digest = self.resume_tokens.pop(session_id, None)
+        self.registry.remove(session_id)
+        if hold and executor is not None and digest is not None:
+            self.holding.hold(session_id, executor, digest)
+        self.connection_options.pop(session_id, None)
+        # a submission still waiting for a slot is dropped; one already running finishes and frees its slot
+        submission = self.submissions.pop(session_id, None)
+        if submission is not None:
+            submission.cancel()
+
+    def evict(self, session_id: str, reason: str, hold: bool):
+        websocket = self.active_connections.get(session_id)
+        self.disconnect(session_id, hold=hold)
+        self.evictions.inc(reason=reason)
+        if websocket is not None:
+            asyncio.ensure_future(self.close_quietly(websocket, reason))
+
+    async def close_quietly(self, websocket: WebSocket, reason: str):
+        try:
+            await websocket.close(code=1001, reason=reason)
+        except Exception:
+            pass
+
+    def sweep(self):
+        self.holding.purge()
+        # idle sockets are closed but stay resumable from the holding area
+        for session_id in self.registry.sweep(self.submissions):
+            self.evict(session_id, "idle", hold=True)
+        self.enforce_memory_budget()
+
+    def enforce_memory_budget(self):
+        budget = self.registry.memory_budget
+        excess = self.registry.bytes + self.holding.bytes + self.store.bytes - budget
+        if excess <= 0:
+            return
+        # cheapest first: drop already-sent actions, then the oldest stored records (an in-memory store
+        # lives in this budget too), then held sessions (their state is in the store), and only then
+        # close live ones
+        excess = self.registry.compact_all(excess, self.submissions)
+        if excess > 0:
+            self.store.shrink(max(0, self.store.bytes - excess))
+            excess = self.registry.bytes + self.holding.bytes + self.store.bytes - budget
+        if excess > 0:
+            self.holding.shrink(max(0, budget - self.registry.bytes - self.store.bytes))
+            excess = self.registry.bytes + self.holding.bytes + self.store.bytes - budget
+        for session_id in self.registry.victims(excess, self.submissions):
+            self.evict(session_id, "memory", hold=False)
+
+    async def run_sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping sessions: {e}")
+
+    def negotiate_options(self, websocket: WebSocket) -> dict:
+        options = dict(DEFAULT_OPTIONS)
+        if websocket.query_params.get("actions_format") in ACTIONS_FORMATS:
+            options["actions_format"] = websocket.query_params["actions_format"]
+        if websocket.query_params.get("frames") in FRAME_TYPES:
+            options["frames"] = websocket.query_params["frames"]
+        if websocket.query_params.get("mode") in MODES:
+            options["mode"] = websocket.query_params["mode"]
+        return options
+
+    def encode_message(self, message: dict, actions_format: str) -> bytes:
+        data = message.get("data")
+        if isinstance(data, dict):
+            message = dict(message, data=format_result(data, actions_format))
+        return self.serializer.dumps(message)
+
+    async def receive_message(self, websocket: WebSocket, session_id: str = None):
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        # sampled here so the trace covers decoding too; None (and no timing at all) when not sampled
+        trace = self.tracer.start("message", session_id=session_id)
+        if trace is not None:
+            decode_start = time.perf_counter()
+        data = message.get("text")
+        decoded = self.serializer.loads(data if data is not None else message["bytes"])
+        if trace is not None:
+            trace.add("decode", decode_start, time.perf_counter())
+        return decoded, trace
     
-    async def send_message(self, websocket: WebSocket, message: dict):
-        await websocket.send_text(json.dumps(message))
+    async def send_message(self, websocket: WebSocket, message: dict, options: dict = DEFAULT_OPTIONS, trace=None):
+        if trace is not None:
+            encode_start = time.perf_counter()
+        if action_count(message) >= OFFLOOP_ACTIONS:
+            loop = asyncio.get_running_loop()
+            payload = await loop.run_in_executor(
+                self.serialize_pool, self.encode_message, message, options["actions_format"]
+            )
+        else:
+            payload = self.encode_message(message, options["actions_format"])
+        if trace is not None:
+            send_start = time.perf_counter()
+            trace.add("encode", encode_start, send_start)
+        if options["frames"] == "binary":
+            await websocket.send_bytes(payload)
+        else:
+            await websocket.send_text(payload.decode())
+        if trace is not None:
+            trace.add("send", send_start, time.perf_counter())
     
-    async def execute_code(self, session_id: str, code: str) -> dict:
+    async def execute_code(self, session_id: str, code: str, on_actions=None, trace=None) -> dict:
         if session_id not in self.game_sessions:
             return {"success": False, "error": "session not found"}
         
-        loop = asyncio.get_event_loop()
+        executor = self.game_sessions[session_id]
+        # taken now, the connection may drop (and the session get parked) while the code runs
+        digest = self.resume_tokens.get(session_id)
         try:
-            result = await loop.run_in_executor(
-                self.thread_pool,
-                partial(self.game_sessions[session_id].execute_player_code, code)
-            )
-            return result
+            result = await self.backend.execute(executor, code, on_actions, trace)
         except Exception as e:
             return {"success": False, "error": str(e)}
+        await self.finish_execution(session_id, executor, digest, [result])
+        return result
+
+    async def execute_batch(self, session_id: str, batch: dict, trace=None) -> dict:
+        if session_id not in self.game_sessions:
+            return {"success": False, "error": "session not found"}
+
+        executor = self.game_sessions[session_id]
+        digest = self.resume_tokens.get(session_id)
+        start_time = time.time()
+        try:
+            results = await self.backend.execute_batch(executor, batch["programs"], batch["fresh"], trace)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        # fresh runs never touched the session, nothing to record
+        if not batch["fresh"]:
+            await self.finish_execution(session_id, executor, digest, results)
+        return {
+            "success": all(result["success"] for result in results),
+            "mode": batch["mode"],
+            "results": results,
+            "player_position": executor.player.position.copy(),
+            "execution_time": time.time() - start_time
+        }
+
+    async def finish_execution(self, session_id: str, executor: GameExecutor, digest: str, results: list):
+        for result in results:
+            executor.record_history(result)
+        self.registry.measure(session_id)
+        self.enforce_memory_budget()
+        try:
+            await self.persist(session_id, executor, digest)
+        except Exception as e:
+            print(f"Error persisting session {session_id}: {e}")
+
+    async def submit_code(self, session_id: str, websocket: WebSocket, code: str, options: dict,
+                          stream: bool = False, trace=None, batch: dict = None):
+        executor = self.game_sessions.get(session_id)
+        notebook = executor is not None and executor.notebook
+        # programs static analysis already rejected are answered right here, without a slot or a worker;
+        # new ones are analyzed by the executor, a big source would stall the loop. not while a run is in
+        # flight though, its result has to go out first, admission answers busy
+        if batch is None and session_id not in self.admission.in_flight:
+            size = len(code.encode())
+            if size > CODE_MAX_BYTES:
+                verdict = {"error_type": "rejected", "error": f"program too large: {size} bytes, max {CODE_MAX_BYTES}",
+                           "line": 1, "text": ""}
+            else:
+                verdict = analysis_cache.lookup(code, defined=executor.namespace_names if notebook else None)
+            if verdict is not None and executor is not None:
+                await self.send_rejection(session_id, websocket, verdict, options, trace)
+                return
+        # a batch takes one slot like a single program; it's coalesced on its mode and programs.
+        # a repeated notebook cell is a new run, so it never matches the one in flight
+        key = code if batch is None else (batch["mode"], tuple(batch["programs"]))
+        ticket = self.admission.try_admit(session_id, object() if notebook else key)
+        ticket["admitted_at"] = time.perf_counter()
+        if ticket["status"] == "busy":
+            self.rejections.inc(reason=ticket["reason"])
+            await self.send_message(websocket, {
+                "type": "busy",
+                "reason": ticket["reason"],
+                "position": ticket["position"],
+                "queue_length": ticket["queue_length"]
+            }, options, trace)
+            if trace is not None:
+                trace.meta["outcome"] = "busy"
+                self.tracer.finish(trace)
+            return
+        if ticket["status"] == "coalesced" or ticket["position"] > 0:
+            await self.send_message(websocket, {
+                "type": "queued",
+                "position": ticket["position"],
+                "queue_length": ticket["queue_length"],
+                "coalesced": ticket["status"] == "coalesced"
+            }, options)
+        if ticket["status"] == "coalesced" and trace is not None:
+            trace.meta["outcome"] = "coalesced"
+            self.tracer.finish(trace)
+        if ticket["status"] == "admitted":
+            submission = asyncio.create_task(
+                self.run_submission(session_id, websocket, code, options, ticket, stream, trace, batch)
+            )
+            # cleanup lives in a callback so it also runs for a task cancelled before its first step
+            submission.add_done_callback(partial(self.submission_done, session_id, ticket))
+            self.submissions[session_id] = submission
+
+    async def send_rejection(self, session_id: str, websocket: WebSocket, verdict: dict, options: dict, trace=None):
+        result = self.game_sessions[session_id].rejected_result(verdict)
+        self.executions.inc()
+        self.errors.inc(type=result["error_type"])
+        await self.send_message(websocket, {"type": "execution_result", "data": result}, options, trace)
+        if trace is not None:
+            trace.meta["outcome"] = "rejected"
+            self.tracer.finish(trace)
+
+    async def run_submission(self, session_id: str, websocket: WebSocket, code: str, options: dict,
+                             ticket: dict, stream: bool = False, trace=None, batch: dict = None):
+        sender = None
+        try:
+            await self.admission.wait(ticket)
+            self.admission.start(ticket)
+            started_at = time.perf_counter()
+            self.queue_wait.observe(started_at - ticket["admitted_at"])
+            if trace is not None:
+                trace.add("admission", ticket["admitted_at"], started_at)
+            on_actions = None
+            if stream:
+                loop = asyncio.get_running_loop()
+                batches = asyncio.Queue()
+                streamed = 0
+
+                def enqueue(batch):
+                    nonlocal streamed
+                    streamed += len(batch)
+                    batches.put_nowait(batch)
+
+                # thread-safe bridge: the worker thread only ever schedules enqueue on the loop
+                on_actions = partial(loop.call_soon_threadsafe, enqueue)
+                sender = asyncio.create_task(self.stream_batches(websocket, batches, options))
+            if batch is not None:
+                execution = asyncio.ensure_future(self.execute_batch(session_id, batch, trace))
+            else:
+                execution = asyncio.ensure_future(self.execute_code(session_id, code, on_actions, trace))
+            # the slot follows the execution itself, which can't be interrupted once it's on a worker
+            execution.add_done_callback(lambda _: self.admission.release())
+            ticket["execution"] = execution
+            result = await asyncio.shield(execution)
+            finished_at = time.perf_counter()
+            self.exec_time.observe(finished_at - started_at)
+            if trace is not None:
+                trace.add("execute", started_at, finished_at)
+            for outcome in result.get("results", [result]):
+                self.executions.inc()
+                if not outcome.get("success"):
+                    self.errors.inc(type=outcome.get("error_type", "internal"))
+            if stream:
+                # batches scheduled by the worker are queued before the result resolves; cache hits
+                # never streamed, so whatever is left goes out as one last batch
+                actions = result.get("actions")
+                if isinstance(actions, ActionLog) and len(actions) > streamed:
+                    enqueue(actions.slice(streamed, len(actions)))
+                batches.put_nowait(None)
+                await sender
+                result = {k: v for k, v in result.items() if k != "actions"}
+                result["streamed"] = True
+            send_start = time.perf_counter()
+            await self.send_message(websocket, {
+                "type": "execution_result" if batch is None else "batch_result",
+                "data": result
+            }, options, trace)
+            self.send_time.observe(time.perf_counter() - send_start)
+            if trace is not None:
+                trace.meta.update(
+                    outcome="executed",
+                    actions=sum(outcome.get("valid_commands", 0) for outcome in result.get("results", [result]))
+                )
+                self.tracer.finish(trace)
+        except Exception as e:
+            print(f"Error in submission: {e}")
+        finally:
+            # a cancelled or failed submission never queues the end marker, the sender would wait forever
+            if sender is not None:
+                sender.cancel()
+                sender.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def stream_batches(self, websocket: WebSocket, batches: asyncio.Queue, options: dict):
+        seq = 0
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                return
+            await self.send_message(websocket, {
+                "type": "action_batch",
+                "seq": seq,
+                "data": {"actions": batch}
+            }, options)
+            seq += 1
+
+    def submission_done(self, session_id: str, ticket: dict, submission: asyncio.Task):
+        self.admission.abandon(ticket)
+        execution = ticket.get("execution")
+        if execution is not None and not execution.done():
+            # cancelled mid-run: the session stays in flight until the execution really ends, so a
+            # resumed connection can't start a second run on the same executor
+            execution.add_done_callback(lambda _: self.admission.finish(session_id))
+        else:
+            self.admission.finish(session_id)
+        if self.submissions.get(session_id) is submission:
+            del self.submissions[session_id]
 
 manager = ConnectionManager()
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     session_id = await manager.connect(websocket)
+    options = manager.connection_options[session_id]
     
     try:
         await manager.send_message(websocket, {
             "type": "connected",
-            "session_id": session_id
-        })
+            "session_id": session_id,
+            "actions_format": options["actions_format"],
+            "actions_formats": ACTIONS_FORMATS,
+            "frames": options["frames"],
+            "resumed": options["resumed"],
+            "resume_token": options["resume_token"],
+            "resume_error": options.get("resume_error"),
+            "mode": options["mode"],
+            "player_position": manager.game_sessions[session_id].player.position
+        }, options)
         
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            message, trace = await manager.receive_message(websocket, session_id)
+            manager.registry.touch(session_id)
             
             if message["type"] == "execute_code":
-                result = await manager.execute_code(session_id, message["code"])
-                response = {
-                    "type": "execution_result",
-                    "data": result
-                }
-                await manager.send_message(websocket, response)
+                if not isinstance(message.get("code"), str):
+                    verdict = {"error_type": "rejected", "error": "code must be a string", "line": 1, "text": ""}
+                    await manager.send_rejection(session_id, websocket, verdict, options, trace)
+                    continue
+                await manager.submit_code(
+                    session_id, websocket, message["code"], options,
+                    stream=bool(message.get("stream", False)),
+                    trace=trace
+                )
+            elif message["type"] == "execute_batch":
+                batch, error = parse_batch(message)
+                if batch is None:
+                    await manager.send_message(websocket, {
+                        "type": "batch_result",
+                        "data": {"success": False, "error": error, "error_type": "invalid_batch"}
+                    }, options)
+                    continue
+                await manager.submit_code(session_id, websocket, None, options, trace=trace, batch=batch)
+            elif message["type"] == "reset":
+                await manager.reset_namespace(session_id, websocket)
+            elif message["type"] == "snapshot":
+                await manager.snapshot(session_id, websocket, message.get("name"), bool(message.get("namespace", False)))
+            elif message["type"] == "restore":
+                await manager.restore_snapshot(session_id, websocket, message.get("name"))
+            elif message["type"] == "resume":
+                session_id = await manager.resume(
+                    session_id, websocket, message.get("session_id"), message.get("resume_token")
+                )
+                options = manager.connection_options[session_id]
                 
     except WebSocketDisconnect:
         manager.disconnect(session_id)
@@ -90,10 +666,22 @@ async def websocket_endpoint(websocket: WebSocket):
 async def root():
     return {"message": "server is running"}
 
+@app.get("/admin/traces")
+async def traces(token: str = "", clear: bool = False):
+    # ADMIN_TOKEN, when set, has to be passed as ?token=
+    if os.environ.get("ADMIN_TOKEN") and token != os.environ["ADMIN_TOKEN"]:
+        raise HTTPException(status_code=403, detail="forbidden")
+    return {"sample_rate": manager.tracer.sample_rate, "traces": manager.tracer.dump(clear)}
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(manager.metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
-        app, 
+        "main:app" if WORKERS > 1 else app, 
         host="0.0.0.0", 
-        port=8000
+        port=8000,
+        workers=WORKERS
     )
@@ -0,0 +1,137 @@
+import bisect
+import math
+
+# latency buckets in seconds, roughly x2.5 apart from 0.5ms to 30s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{str(value)}"' for key, value in sorted(labels.items()))
+    return "{" + inner + "}"
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(key), value
+
+class Gauge:
+    kind = "gauge"
+
+    # read is a callable so the value comes straight from the live state at scrape time
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def samples(self):
+        yield self.name, {}, self.read()
+
+class CounterFunc(Gauge):
+    # a counter some other object keeps as a plain number, read at scrape time like a gauge
+    kind = "counter"
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            yield self.name + "_bucket", {"le": _format_value(bound)}, cumulative
+        yield self.name + "_sum", {}, self.sum
+        yield self.name + "_count", {}, self.count
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, read) -> Gauge:
+        return self.register(Gauge(name, help_text, read))
+
+    def counter_func(self, name: str, help_text: str, read) -> CounterFunc:
+        return self.register(CounterFunc(name, help_text, read))
+
+    def histogram(self, name: str, help_text: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        # prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def parse_metrics(text: str) -> dict:
+    # minimal parser for our own /metrics output: {(name, ((label, value), ...)): float}
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, _, value = line.rpartition(" ")
+        name, _, labels = series.partition("{")
+        pairs = []
+        for part in labels.rstrip("}").split(","):
+            if "=" in part:
+                key, _, label_value = part.partition("=")
+                pairs.append((key, label_value.strip('"')))
+        samples[(name, tuple(sorted(pairs)))] = float(value)
+    return samples
+
+def histogram_quantile(samples: dict, name: str, quantile: float, previous: dict = None) -> float:
+    # upper bound of the bucket holding the quantile; with `previous`, only over what happened in between
+    buckets = []
+    for (sample_name, labels), value in samples.items():
+        if sample_name == name + "_bucket":
+            le = dict(labels)["le"]
+            bound = math.inf if le == "+Inf" else float(le)
+            if previous is not None:
+                value -= previous.get((sample_name, labels), 0.0)
+            buckets.append((bound, value))
+    buckets.sort()
+    if not buckets or buckets[-1][1] <= 0:
+        return 0.0
+    target = quantile * buckets[-1][1]
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            return bound
+    return math.inf
@@ -1,24 +1,55 @@
 import time
 import requests
 import psutil
-import os
 from datetime import datetime
+from metrics import parse_metrics, histogram_quantile
 
 class SimpleMonitor:
     def __init__(self):
         self.server_url = "http://127.0.0.1:8000"
         self.monitoring = True
+        self.previous_metrics = None
     
-    def get_python_process(self):
-        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-            try:
-                if proc.info['name'] and 'python' in proc.info['name'].lower():
-                    cmdline = ' '.join(proc.info['cmdline']) if proc.info['cmdline'] else ''
-                    if 'main.py' in cmdline:
-                        return psutil.Process(proc.info['pid'])
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+    def get_metrics(self):
+        try:
+            response = requests.get(f"{self.server_url}/metrics", timeout=2)
+            if response.status_code == 200:
+                return parse_metrics(response.text)
+        except Exception:
+            pass
         return None
+
+    def metric(self, samples, name, **labels):
+        return samples.get((name, tuple(sorted(labels.items()))), 0.0)
+
+    def total(self, samples, name):
+        return sum(value for (sample_name, _), value in samples.items() if sample_name == name)
+
+    def format_metrics(self, samples):
+        # latency percentiles and error counts cover only the interval since the previous scrape
+        previous = self.previous_metrics or {}
+        exec_p50 = histogram_quantile(samples, "game_exec_seconds", 0.5, previous)
+        exec_p95 = histogram_quantile(samples, "game_exec_seconds", 0.95, previous)
+        wait_p95 = histogram_quantile(samples, "game_queue_wait_seconds", 0.95, previous)
+        errors = self.total(samples, "game_execution_errors_total") - self.total(previous, "game_execution_errors_total")
+        executions = self.metric(samples, "game_executions_total") - self.metric(previous, "game_executions_total")
+        evictions = self.total(samples, "game_session_evictions_total") - self.total(previous, "game_session_evictions_total")
+        held_drops = (
+            self.metric(samples, "game_held_sessions_evicted_total") + self.metric(samples, "game_held_sessions_expired_total")
+            - self.metric(previous, "game_held_sessions_evicted_total") - self.metric(previous, "game_held_sessions_expired_total")
+        )
+        session_bytes = (self.metric(samples, "game_session_bytes") + self.metric(samples, "game_held_session_bytes")
+                         + self.metric(samples, "game_session_store_bytes"))
+        return (
+            f"Conn: {self.metric(samples, 'game_active_connections'):.0f} "
+            f"Workers: {self.metric(samples, 'game_pool_busy_workers'):.0f}/{self.metric(samples, 'game_pool_workers'):.0f} "
+            f"Queue: {self.metric(samples, 'game_queue_length'):.0f} | "
+            f"Exec: {executions:.0f} p50<={exec_p50 * 1000:.1f}ms p95<={exec_p95 * 1000:.1f}ms "
+            f"Wait p95<={wait_p95 * 1000:.1f}ms Errors: {errors:.0f} | "
+            f"Sess: {self.metric(samples, 'game_sessions'):.0f}+{self.metric(samples, 'game_held_sessions'):.0f} held "
+            f"{self.format_bytes(session_bytes)}/{self.format_bytes(self.metric(samples, 'game_session_memory_budget_bytes'))} "
+            f"Evicted: {evictions:.0f} live {held_drops:.0f} held"
+        )
     
     def get_server_stats(self):
         try:
@@ -49,22 +80,17 @@ class SimpleMonitor:
                 cpu = psutil.cpu_percent()
                 memory = psutil.virtual_memory()
                 
-                # process stats
-                server_proc = self.get_python_process()
-                if server_proc:
-                    try:
-                        proc_cpu = server_proc.cpu_percent()
-                        proc_memory = server_proc.memory_info()
-                        proc_status = f"CPU: {proc_cpu:.1f}% RAM: {self.format_bytes(proc_memory.rss)}"
-                    except:
-                        proc_status = "process unavailable"
+                # server stats from /metrics
+                samples = self.get_metrics()
+                if samples is not None:
+                    server_status = "running"
+                    metrics_status = self.format_metrics(samples)
+                    self.previous_metrics = samples
                 else:
-                    proc_status = "server not found"
-                
-                server_stats = self.get_server_stats()
-                server_status = server_stats.get("status", "unknown")
+                    server_status = self.get_server_stats().get("status", "unknown")
+                    metrics_status = "metrics unavailable"
                 
-                print(f"{timestamp} | CPU: {cpu:5.1f}% | "f"RAM: {memory.percent:5.1f}% | "f"Server: {server_status:10} | "f"Process: {proc_status}")
+                print(f"{timestamp} | CPU: {cpu:5.1f}% | "f"RAM: {memory.percent:5.1f}% | "f"Server: {server_status:10} | "f"{metrics_status}")
                 
                 time.sleep(3)
                 
@@ -0,0 +1,132 @@
+import ast
+import threading
+import time
+from collections import OrderedDict
+from sandbox import source_hash
+
+MOVE_METHODS = frozenset(("move_up", "move_down", "move_left", "move_right"))
+
+def is_translation_invariant(code: str) -> bool:
+    # true when `player` is only ever used as player.move_*(...), so the program can't observe where it starts
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    move_receivers = set()
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in MOVE_METHODS and isinstance(node.func.value, ast.Name)):
+            move_receivers.add(id(node.func.value))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "player" and id(node) not in move_receivers:
+            return False
+        if isinstance(node, (ast.Global, ast.Nonlocal)) and "player" in node.names:
+            return False
+    return True
+
+def _on_grid(position) -> bool:
+    # player code can set any position; only integer points are shifted and cached
+    return (isinstance(position, dict) and type(position.get("x")) is int and type(position.get("y")) is int)
+
+def _shift(position: dict, dx: int, dy: int) -> dict:
+    return {"x": position["x"] + dx, "y": position["y"] + dy}
+
+class ResultCache:
+    # memoizes finished runs; entries are stored relative to the start position so invariant
+    # programs hit from any origin, others are keyed by (code, origin)
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.invariant = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _key(self, code: str, origin: dict) -> tuple:
+        digest = source_hash(code)
+        with self.lock:
+            invariant = self.invariant.get(digest)
+        if invariant is None:
+            invariant = is_translation_invariant(code)
+            with self.lock:
+                self.invariant[digest] = invariant
+                while len(self.invariant) > self.max_size:
+                    self.invariant.popitem(last=False)
+        if invariant:
+            return (digest,)
+        return (digest, origin["x"], origin["y"])
+
+    def _store(self, key: tuple, result: dict, origin: dict, final: dict):
+        dx, dy = -origin["x"], -origin["y"]
+        entry = {
+            "result": {k: v for k, v in result.items() if k not in ("actions", "player_position", "execution_time")},
+            "actions": result["actions"].translated(dx, dy),
+            "player_position": _shift(result["player_position"], dx, dy),
+            "final_position": _shift(final, dx, dy)
+        }
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def _replay(self, executor, entry: dict, origin: dict, start_time: float) -> dict:
+        dx, dy = origin["x"], origin["y"]
+        # a failed run leaves the player wherever it got to, same as a real execution
+        executor.player.position = _shift(entry["final_position"], dx, dy)
+        return dict(
+            entry["result"],
+            actions=entry["actions"].translated(dx, dy),
+            player_position=_shift(entry["player_position"], dx, dy),
+            execution_time=time.time() - start_time,
+            cached=True
+        )
+
+    def _lookup(self, key: tuple):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def execute(self, executor, code: str, run) -> dict:
+        start_time = time.time()
+        if not _on_grid(executor.player.position):
+            return run(code)
+        origin = executor.player.position.copy()
+        key = self._key(code, origin)
+
+        entry = self._lookup(key)
+        if entry is not None:
+            return self._replay(executor, entry, origin, start_time)
+
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending is None:
+                self.pending[key] = threading.Event()
+            self.misses += 1
+
+        if pending is not None:
+            # someone is already running this program; wait for their entry instead of running it again
+            pending.wait()
+            entry = self._lookup(key)
+            if entry is not None:
+                return self._replay(executor, entry, origin, start_time)
+            # their run wasn't cacheable, don't line up behind each other
+            return run(code)
+
+        try:
+            result = run(code)
+            # wall-time overruns depend on load, everything else is a pure function of (code, origin)
+            if result.get("error_type") != "budget_exceeded" and _on_grid(executor.player.position):
+                self._store(key, result, origin, executor.player.position)
+            return result
+        finally:
+            with self.lock:
+                event = self.pending.pop(key)
+            event.set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,233 @@
+import ast
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import FunctionType, MappingProxyType
+
+TICK_NAME = "__budget_tick__"
+TICK_ITER_NAME = "__budget_iter__"
+RESERVED_NAMES = frozenset((TICK_NAME, TICK_ITER_NAME))
+
+# the allowed-builtins policy, the only place to change what player code can call besides `player`
+# and `print` (always bound to the run's output sink). modules go in the same way, e.g. "math": math
+SAFE_BUILTINS = MappingProxyType({
+    "range": range,
+    "len": len,
+    "int": int,
+    "str": str,
+    "float": float,
+    "bool": bool,
+    "list": list,
+    "dict": dict,
+    "tuple": tuple,
+    "min": min,
+    "max": max,
+    "abs": abs,
+    "sum": sum,
+    "enumerate": enumerate,
+    "zip": zip,
+})
+
+_BUILTINS_DICT = dict(SAFE_BUILTINS)
+
+def make_globals_template(player) -> dict:
+    # built once per session; run_globals() turns it into the namespace of one run
+    return {"__builtins__": None, "player": player}
+
+def run_globals(template: dict) -> dict:
+    # the builtins are a private flat copy per run: one shared dict could be poisoned for later runs
+    # (it's reachable from player code, e.g. through gi_frame.f_builtins), and handing out the
+    # read-only mappingproxy makes builtin lookups ~3x slower since CPython only specializes real dicts
+    namespace = template.copy()
+    namespace["__builtins__"] = _BUILTINS_DICT.copy()
+    return namespace
+
+# what the sandbox itself puts into a run's globals, never counted as player state
+SANDBOX_NAMES = frozenset(("__builtins__", "player", "print")) | RESERVED_NAMES
+
+def namespace_nbytes(namespace: dict, limit: int = None) -> int:
+    # rough deep size of what player code keeps in `namespace`; containers and function defaults and
+    # closures are followed, and counting stops as soon as it passes `limit`, so it never costs more than that
+    total = sys.getsizeof(namespace)
+    pending = [value for name, value in namespace.items() if name not in SANDBOX_NAMES]
+    seen = set()
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if limit is not None and total > limit:
+            break
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif isinstance(obj, FunctionType):
+            pending.extend(obj.__defaults__ or ())
+            for cell in obj.__closure__ or ():
+                try:
+                    pending.append(cell.cell_contents)
+                except ValueError:
+                    # a closure variable that isn't assigned yet
+                    continue
+    return total
+
+@dataclass(frozen=True)
+class ExecutionBudget:
+    wall_time: float = 2.0
+    max_ticks: int = 1_000_000
+    max_actions: int = 10_000
+
+DEFAULT_BUDGET = ExecutionBudget()
+
+# derives from BaseException so `except Exception` in player code can't swallow it
+class BudgetExceeded(BaseException):
+    def __init__(self, kind: str, limit):
+        self.kind = kind
+        self.limit = limit
+        super().__init__(f"{kind} limit of {limit} exceeded")
+
+class BudgetMeter:
+    def __init__(self, budget: ExecutionBudget = DEFAULT_BUDGET):
+        self.max_ticks = budget.max_ticks
+        self.max_actions = budget.max_actions
+        self.wall_time = budget.wall_time
+        self.deadline = time.perf_counter() + budget.wall_time
+        self.ticks = 0
+        self.exceeded = None
+        # streaming runs hand the meter their flush, so actions go out on time even while a run computes
+        self.flush = None
+        self.flush_at = float("inf")
+
+    def trip(self, kind: str, limit):
+        # keeps raising on every later tick, so a bare `except:` only buys one more line
+        if self.exceeded is None:
+            self.exceeded = BudgetExceeded(kind, limit)
+        raise self.exceeded
+
+    def tick(self):
+        self.ticks += 1
+        if self.exceeded is not None:
+            raise self.exceeded
+        if self.ticks > self.max_ticks:
+            self.trip("instruction", self.max_ticks)
+        now = time.perf_counter()
+        if now > self.deadline:
+            self.trip("wall time", f"{self.wall_time}s")
+        if now >= self.flush_at:
+            self.flush()
+
+    def iterate(self, iterable):
+        tick = self.tick
+        for item in iterable:
+            tick()
+            yield item
+
+    def check_actions(self, count: int):
+        if count >= self.max_actions:
+            self.trip("action", self.max_actions)
+
+    def namespace(self) -> dict:
+        return {TICK_NAME: self.tick, TICK_ITER_NAME: self.iterate}
+
+def _tick_call(node):
+    return ast.copy_location(ast.Expr(ast.Call(ast.Name(TICK_NAME, ast.Load()), [], [])), node)
+
+class _TickInserter(ast.NodeTransformer):
+    # a tick at the top of every loop body and function body bounds the work any program can do
+
+    def _tick_body(self, node):
+        self.generic_visit(node)
+        node.body.insert(0, _tick_call(node.body[0]))
+        return node
+
+    visit_For = _tick_body
+    visit_AsyncFor = _tick_body
+    visit_While = _tick_body
+    visit_FunctionDef = _tick_body
+    visit_AsyncFunctionDef = _tick_body
+
+    def visit_Lambda(self, node):
+        self.generic_visit(node)
+        tick = ast.Call(ast.Name(TICK_NAME, ast.Load()), [], [])
+        pair = ast.Tuple([tick, node.body], ast.Load())
+        node.body = ast.copy_location(ast.Subscript(pair, ast.Constant(1), ast.Load()), node.body)
+        return node
+
+    def visit_comprehension(self, node):
+        self.generic_visit(node)
+        node.iter = ast.copy_location(
+            ast.Call(ast.Name(TICK_ITER_NAME, ast.Load()), [node.iter], []),
+            node.iter
+        )
+        return node
+
+def _check_reserved(tree):
+    for node in ast.walk(tree):
+        names = getattr(node, "names", None)
+        if not isinstance(names, list):
+            names = []
+        for name in [getattr(node, "id", None), getattr(node, "arg", None), getattr(node, "name", None), *names]:
+            if isinstance(name, str) and name in RESERVED_NAMES:
+                location = ("<string>", getattr(node, "lineno", None), getattr(node, "col_offset", 0) + 1, None)
+                raise SyntaxError(f"'{name}' is a reserved name", location)
+
+def compile_player_code(code: str):
+    tree = ast.parse(code, "<string>", "exec")
+    _check_reserved(tree)
+    tree = ast.fix_missing_locations(_TickInserter().visit(tree))
+    return compile(tree, "<string>", "exec")
+
+def source_hash(code: str) -> bytes:
+    return hashlib.sha256(code.encode("utf-8", "surrogatepass")).digest()
+
+class CodeCache:
+    # LRU of compiled (and budget-instrumented) code objects shared by every session
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def compile(self, code: str):
+        key = source_hash(code)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            try:
+                entry = (compile_player_code(code), None)
+            except SyntaxError as e:
+                entry = (None, e.args)
+            with self.lock:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+
+        compiled, error_args = entry
+        if error_args is not None:
+            # a fresh instance per raise, the cached one would pick up tracebacks across threads
+            raise SyntaxError(*error_args)
+        return compiled
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+code_cache = CodeCache()
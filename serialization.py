@@ -0,0 +1,77 @@
+import json
+import os
+from game_executor import ActionLog
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+def encode_default(obj):
+    # action logs stay compact until the frame is actually written
+    if isinstance(obj, ActionLog):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _json_dumps(obj) -> bytes:
+    return json.dumps(obj, default=encode_default).encode()
+
+class JsonSerializer:
+    name = "json"
+
+    def dumps(self, obj) -> bytes:
+        return _json_dumps(obj)
+
+    def loads(self, data):
+        return json.loads(data)
+
+class OrjsonSerializer:
+    name = "orjson"
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return orjson.dumps(obj, default=encode_default)
+        except TypeError:
+            # orjson stops at 64-bit ints, player code can produce bigger ones
+            return _json_dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+class MsgspecSerializer:
+    name = "msgspec"
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder(enc_hook=encode_default)
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return self.encoder.encode(obj)
+        except (TypeError, msgspec.EncodeError):
+            return _json_dumps(obj)
+
+    def loads(self, data):
+        return self.decoder.decode(data)
+
+SERIALIZERS = {
+    "json": JsonSerializer,
+    "orjson": OrjsonSerializer if orjson is not None else None,
+    "msgspec": MsgspecSerializer if msgspec is not None else None,
+}
+
+def get_serializer(name: str = None):
+    # SERIALIZER picks one explicitly, otherwise the fastest installed backend wins
+    name = name or os.environ.get("SERIALIZER")
+    if name:
+        if SERIALIZERS.get(name) is None:
+            raise ValueError(f"serializer not available: {name}")
+        return SERIALIZERS[name]()
+    for candidate in ("orjson", "msgspec", "json"):
+        if SERIALIZERS[candidate] is not None:
+            return SERIALIZERS[candidate]()
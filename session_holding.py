@@ -0,0 +1,104 @@
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+# how long a dropped connection's executor is kept around for a `resume`
+HOLD_TTL = 300
+HOLD_MAX_SESSIONS = 10000
+HOLD_MAX_BYTES = 64 * 1024 * 1024
+
+def new_resume_token() -> str:
+    return secrets.token_urlsafe(24)
+
+def token_digest(token: str) -> str:
+    # stores only keep the digest, a leaked sessions.db doesn't hand out live tokens
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def token_matches(token: str, digest: str) -> bool:
+    if not token or not digest:
+        return False
+    return hmac.compare_digest(token_digest(token), digest)
+
+class HoldingArea:
+    # orphaned GameExecutors by session id, oldest first; entries leave on resume, after `ttl`,
+    # or least recently dropped first once the count or byte budget is exceeded
+    def __init__(self, ttl: float = HOLD_TTL, max_sessions: int = HOLD_MAX_SESSIONS,
+                 max_bytes: int = HOLD_MAX_BYTES):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, session_id: str):
+        return session_id in self.entries
+
+    def hold(self, session_id: str, executor, digest: str):
+        self.drop(session_id)
+        size = executor.nbytes()
+        self.entries[session_id] = {
+            "executor": executor,
+            "digest": digest,
+            "bytes": size,
+            "expires_at": time.monotonic() + self.ttl
+        }
+        self.bytes += size
+        self.purge()
+        self.shrink(self.max_bytes, self.max_sessions)
+
+    def take(self, session_id: str, token: str):
+        # a wrong token leaves the entry where it is, so guessing can't knock a session out
+        self.purge()
+        entry = self.entries.get(session_id)
+        if entry is None or not token_matches(token, entry["digest"]):
+            return None
+        self.drop(session_id)
+        return entry["executor"]
+
+    def drop(self, session_id: str):
+        entry = self.entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry["bytes"]
+
+    def shrink(self, max_bytes: int, max_sessions: int = None):
+        # least recently dropped go first
+        if max_sessions is None:
+            max_sessions = self.max_sessions
+        while self.entries and (len(self.entries) > max_sessions or self.bytes > max_bytes):
+            self.drop(next(iter(self.entries)))
+            self.evicted += 1
+
+    def purge(self):
+        now = time.monotonic()
+        # insertion order is expiry order, every entry gets the same ttl
+        while self.entries:
+            session_id, entry = next(iter(self.entries.items()))
+            if entry["expires_at"] > now:
+                break
+            self.drop(session_id)
+            self.expired += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.entries),
+            "bytes": self.bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted
+        }
+
+def holding_area_from_env() -> HoldingArea:
+    return HoldingArea(
+        float(os.environ.get("HOLD_TTL", HOLD_TTL)),
+        int(os.environ.get("HOLD_MAX_SESSIONS", HOLD_MAX_SESSIONS)),
+        int(os.environ.get("HOLD_MAX_BYTES", HOLD_MAX_BYTES))
+    )
@@ -0,0 +1,115 @@
+import os
+import time
+from collections import OrderedDict
+
+# sessions with no client message for this long get their last run's actions dropped
+SESSION_COMPACT_AFTER = 60
+# ... and after this long their socket is closed (the executor moves to the holding area)
+SESSION_IDLE_TIMEOUT = 15 * 60
+# live plus held sessions; past it idle sessions are compacted, held ones dropped, then live ones closed
+SESSION_MEMORY_BUDGET = 256 * 1024 * 1024
+SWEEP_INTERVAL = 10
+
+class SessionRegistry:
+    # live sessions by last client activity, least recently active first, with their estimated size
+    def __init__(self, compact_after: float = SESSION_COMPACT_AFTER, idle_timeout: float = SESSION_IDLE_TIMEOUT,
+                 memory_budget: int = SESSION_MEMORY_BUDGET):
+        self.compact_after = compact_after
+        self.idle_timeout = idle_timeout
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.compactions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, session_id: str, executor):
+        self.remove(session_id)
+        self.entries[session_id] = {
+            "executor": executor,
+            "bytes": 0,
+            "last_active": time.monotonic(),
+            "compacted": False
+        }
+        self.measure(session_id)
+
+    def remove(self, session_id: str):
+        entry = self.entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry["bytes"]
+
+    def touch(self, session_id: str):
+        entry = self.entries.get(session_id)
+        if entry is not None:
+            entry["last_active"] = time.monotonic()
+            entry["compacted"] = False
+            self.entries.move_to_end(session_id)
+
+    def measure(self, session_id: str):
+        # sizes change with every run, the caller re-measures after one finishes
+        entry = self.entries.get(session_id)
+        if entry is not None:
+            size = entry["executor"].nbytes()
+            self.bytes += size - entry["bytes"]
+            entry["bytes"] = size
+
+    def compact(self, session_id: str):
+        entry = self.entries[session_id]
+        entry["executor"].compact()
+        entry["compacted"] = True
+        self.compactions += 1
+        self.measure(session_id)
+
+    def sweep(self, busy=()) -> list:
+        # compacts sessions idle past compact_after, returns the ones idle past idle_timeout
+        now = time.monotonic()
+        expired = []
+        for session_id, entry in self.entries.items():
+            idle_for = now - entry["last_active"]
+            if idle_for < min(self.compact_after, self.idle_timeout):
+                break
+            if session_id in busy:
+                continue
+            if idle_for >= self.idle_timeout:
+                expired.append(session_id)
+            elif idle_for >= self.compact_after and not entry["compacted"]:
+                self.compact(session_id)
+        return expired
+
+    def compact_all(self, excess: int, busy=()) -> int:
+        # least recently active first, stops once `excess` bytes are freed; returns what's still over
+        for session_id, entry in self.entries.items():
+            if excess <= 0:
+                break
+            if session_id not in busy and not entry["compacted"]:
+                before = entry["bytes"]
+                self.compact(session_id)
+                excess -= before - entry["bytes"]
+        return excess
+
+    def victims(self, excess: int, busy=()) -> list:
+        # least recently active sessions whose sizes add up to `excess`
+        victims = []
+        for session_id, entry in self.entries.items():
+            if excess <= 0:
+                break
+            if session_id not in busy:
+                victims.append(session_id)
+                excess -= entry["bytes"]
+        return victims
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.entries),
+            "bytes": self.bytes,
+            "memory_budget": self.memory_budget,
+            "compactions": self.compactions
+        }
+
+def session_registry_from_env() -> SessionRegistry:
+    return SessionRegistry(
+        float(os.environ.get("SESSION_COMPACT_AFTER", SESSION_COMPACT_AFTER)),
+        float(os.environ.get("SESSION_IDLE_TIMEOUT", SESSION_IDLE_TIMEOUT)),
+        int(os.environ.get("SESSION_MEMORY_BUDGET", SESSION_MEMORY_BUDGET))
+    )
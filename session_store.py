@@ -0,0 +1,179 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# records untouched for this long are dropped, a reconnect after that starts a new session
+SESSION_TTL = 24 * 60 * 60
+PURGE_EVERY = 500
+# the in-memory store keeps at most this many records / estimated bytes, least recently saved go first
+STORE_MAX_RECORDS = 10000
+STORE_MAX_BYTES = 64 * 1024 * 1024
+# rough in-memory cost of a record's parts: the dicts around it, one rle run, one plain-list action
+RECORD_OVERHEAD = 1024
+RUN_BYTES = 96
+ACTION_BYTES = 600
+
+def _log_nbytes(encoded: dict) -> int:
+    if encoded.get("format") == "list":
+        return ACTION_BYTES * len(encoded["actions"])
+    return RUN_BYTES * len(encoded["runs"])
+
+def record_nbytes(record: dict) -> int:
+    # estimated from the run counts, serializing every record just to size it would cost more than saving it
+    return (RECORD_OVERHEAD + _log_nbytes(record["history"])
+            + sum(RECORD_OVERHEAD + _log_nbytes(snapshot[3]) for snapshot in record.get("snapshots", ())))
+
+class InMemorySessionStore:
+    # only visible to one process, fine for a single uvicorn worker. it lives in the server's memory,
+    # so it's bounded and its size counts towards SESSION_MEMORY_BUDGET
+    blocking = False
+    shared = False
+
+    def __init__(self, ttl: float = SESSION_TTL, max_records: int = STORE_MAX_RECORDS, max_bytes: int = STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        # least recently saved or claimed first
+        self.records = OrderedDict()
+        self.bytes = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def load(self, session_id: str):
+        with self.lock:
+            entry = self.records.get(session_id)
+        if entry is None or time.time() - entry["updated_at"] > self.ttl:
+            return None
+        return entry
+
+    def save(self, session_id: str, record: dict, owner: str):
+        with self.lock:
+            self._drop(session_id)
+            self.records[session_id] = {
+                "record": record, "owner": owner, "updated_at": time.time(), "bytes": record_nbytes(record)
+            }
+            self.bytes += self.records[session_id]["bytes"]
+            self.writes += 1
+            # oldest first, so stale records are all at the front
+            cutoff = time.time() - self.ttl
+            while self.records and next(iter(self.records.values()))["updated_at"] < cutoff:
+                self._drop(next(iter(self.records)))
+        self.shrink(self.max_bytes)
+
+    def claim(self, session_id: str, owner: str):
+        # pins the session to `owner` (the worker now holding its socket) and returns the stored record
+        with self.lock:
+            entry = self.records.get(session_id)
+            if entry is None or time.time() - entry["updated_at"] > self.ttl:
+                return None
+            previous = entry["owner"]
+            entry["owner"] = owner
+            entry["updated_at"] = time.time()
+            self.records.move_to_end(session_id)
+        return dict(entry, previous_owner=previous)
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self._drop(session_id)
+
+    def shrink(self, max_bytes: int):
+        with self.lock:
+            while self.records and (len(self.records) > self.max_records or self.bytes > max_bytes):
+                self._drop(next(iter(self.records)))
+                self.evicted += 1
+
+    def _drop(self, session_id: str):
+        entry = self.records.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry["bytes"]
+
+class SqliteSessionStore:
+    # a shared file, so every uvicorn worker (or anything on the same box) sees the same sessions
+    blocking = True
+    shared = True
+    # on disk, nothing held in memory
+    bytes = 0
+    evicted = 0
+
+    def __init__(self, path: str, ttl: float = SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.local = threading.local()
+        self.writes = 0
+        with self.connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, record TEXT NOT NULL, owner TEXT, updated_at REAL NOT NULL)"
+            )
+
+    def connection(self) -> sqlite3.Connection:
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def load(self, session_id: str):
+        row = self.connection().execute(
+            "SELECT record, owner, updated_at FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"record": json.loads(row[0]), "owner": row[1], "updated_at": row[2]}
+
+    def save(self, session_id: str, record: dict, owner: str):
+        with self.connection() as db:
+            db.execute(
+                "INSERT INTO sessions (session_id, record, owner, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET record = excluded.record, owner = excluded.owner, "
+                "updated_at = excluded.updated_at",
+                (session_id, json.dumps(record), owner, time.time())
+            )
+            self.writes += 1
+            if self.writes % PURGE_EVERY == 0:
+                db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    def claim(self, session_id: str, owner: str):
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT record, owner FROM sessions WHERE session_id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE sessions SET owner = ?, updated_at = ? WHERE session_id = ?",
+                (owner, time.time(), session_id)
+            )
+        return {"record": json.loads(row[0]), "owner": owner, "previous_owner": row[1]}
+
+    def delete(self, session_id: str):
+        with self.connection() as db:
+            db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def shrink(self, max_bytes: int):
+        pass
+
+def make_session_store(spec: str = "memory"):
+    # "memory" or "sqlite:<path>"
+    if spec == "memory":
+        return InMemorySessionStore(
+            max_records=int(os.environ.get("SESSION_STORE_MAX_RECORDS", STORE_MAX_RECORDS)),
+            max_bytes=int(os.environ.get("SESSION_STORE_MAX_BYTES", STORE_MAX_BYTES))
+        )
+    if spec.startswith("sqlite:"):
+        return SqliteSessionStore(spec[len("sqlite:"):] or "sessions.db")
+    raise ValueError(f"unknown session store: {spec}")
+
+def default_store_spec(workers: int) -> str:
+    return os.environ.get("SESSION_STORE") or ("memory" if workers <= 1 else "sqlite:sessions.db")
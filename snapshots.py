@@ -0,0 +1,104 @@
+import copy
+import os
+import time
+from collections import OrderedDict
+from action_log import ActionLog
+from sandbox import SANDBOX_NAMES
+
+# named snapshots kept per session, the oldest goes first
+SNAPSHOT_LIMIT = int(os.environ.get("SNAPSHOT_LIMIT", 8))
+SNAPSHOT_NAME_MAX = 64
+
+class Snapshot:
+    # position is a copy, history is the executor's log itself (it copies before appending again),
+    # namespace is a copy of a notebook session's variables or None
+    __slots__ = ("name", "position", "history", "namespace", "namespace_bytes", "created", "encoded")
+
+    def __init__(self, name: str, position: dict, history: ActionLog, namespace: dict = None, namespace_bytes: int = 0):
+        self.name = name
+        self.position = position
+        self.history = history
+        self.namespace = namespace
+        self.namespace_bytes = namespace_bytes
+        self.created = time.time()
+        self.encoded = None
+
+    def runs(self) -> dict:
+        # the log never changes while a snapshot holds it, so it's encoded once, not on every persist
+        if self.encoded is None:
+            self.encoded = self.history.to_runs()
+        return self.encoded
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "player_position": self.position,
+            "actions": len(self.history),
+            "namespace": self.namespace is not None,
+            "created": self.created
+        }
+
+def _copy(value, memo: dict):
+    try:
+        return copy.deepcopy(value, memo)
+    except Exception:
+        # generators and the like can't be copied, both sides keep the same one
+        return value
+
+def copy_namespace(namespace: dict, player) -> dict:
+    # the player's variables only; functions are kept as they are, their globals are the live namespace.
+    # the player object itself is shared too (`p = player`), copying it would copy the whole executor
+    memo = {id(player): player}
+    return {name: _copy(value, memo) for name, value in namespace.items() if name not in SANDBOX_NAMES}
+
+class SnapshotRing:
+    def __init__(self, limit: int = SNAPSHOT_LIMIT):
+        self.limit = limit
+        self.entries = OrderedDict()
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def next_name(self) -> str:
+        # a ring loaded from a store starts counting over, names already in it are skipped
+        self.counter += 1
+        while f"snapshot-{self.counter}" in self.entries:
+            self.counter += 1
+        return f"snapshot-{self.counter}"
+
+    def add(self, snapshot: Snapshot):
+        # taking a snapshot under an existing name replaces it and makes it the newest
+        self.entries.pop(snapshot.name, None)
+        self.entries[snapshot.name] = snapshot
+        while len(self.entries) > self.limit:
+            self.entries.popitem(last=False)
+
+    def get(self, name: str):
+        return self.entries.get(name)
+
+    def names(self) -> list:
+        return list(self.entries)
+
+    def nbytes(self) -> int:
+        # snapshots taken without a run in between share one history log, it's counted once
+        logs = {id(snapshot.history): snapshot.history for snapshot in self.entries.values()}
+        return (sum(log.nbytes() for log in logs.values())
+                + sum(snapshot.namespace_bytes for snapshot in self.entries.values()))
+
+    def export(self) -> list:
+        # [[name, x, y, rle history, created], ...] for session stores; namespaces stay in memory only
+        return [
+            [name, snapshot.position["x"], snapshot.position["y"], snapshot.runs(), snapshot.created]
+            for name, snapshot in self.entries.items()
+        ]
+
+    @classmethod
+    def load(cls, entries: list, limit: int = SNAPSHOT_LIMIT) -> "SnapshotRing":
+        ring = cls(limit)
+        for name, x, y, history, created in entries:
+            snapshot = Snapshot(name, {"x": x, "y": y}, ActionLog.from_runs(history))
+            snapshot.created = created
+            snapshot.encoded = history
+            ring.add(snapshot)
+        return ring
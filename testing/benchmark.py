@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import psutil
+import requests
+import websockets
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from game_executor import GameExecutor
+
+# reproducible benchmarks: fixed workloads, fixed iteration counts, warmup before measuring.
+#
+#   python testing/benchmark.py run --out before.json              (micro + e2e)
+#   python testing/benchmark.py run --skip-e2e --out after.json
+#   python testing/benchmark.py compare before.json after.json     (exit 1 on a regression)
+#
+# e2e spawns its own server (uvicorn main:app on --port), extra server env goes in with --env KEY=VALUE
+
+WORKLOADS = {
+    # straight-line moves, served by the fast path
+    "fast_path": "for _ in range(10):\n    player.move_right(1)\n    player.move_down(1)",
+    # arithmetic and branching, has to go through exec
+    "exec_loop": """
+target_x, target_y = 10, 10
+x, y = 0, 0
+for step in range(50):
+    if x < target_x:
+        player.move_right(1)
+        x += 1
+    if y < target_y:
+        player.move_down(1)
+        y += 1
+    if x == target_x and y == target_y:
+        break
+total = 0
+for i in range(2000):
+    total += i % 7
+""",
+    "output": "for i in range(200):\n    print('line', i)",
+    # past the fast path's action cap, big results on the wire
+    "many_actions": "for i in range(3000):\n    player.move_right(1)",
+    "runtime_error": "player.move_up(1)\nvalues = []\nprint(values[3])",
+    # refused by static analysis before any execution
+    "rejected": "import os",
+}
+E2E_WORKLOADS = ("fast_path", "exec_loop", "many_actions")
+
+def percentile(sorted_values: list, q: float) -> float:
+    # nearest rank
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0
+    }
+
+def run_micro(iterations: int, warmup: int) -> dict:
+    process = psutil.Process()
+    results = {}
+    for name, code in WORKLOADS.items():
+        executor = GameExecutor()
+        for _ in range(warmup):
+            executor.execute_player_code(code)
+        rss_before = process.memory_info().rss
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            call_start = time.perf_counter()
+            executor.execute_player_code(code)
+            latencies.append(time.perf_counter() - call_start)
+        stats = summarize(latencies, time.perf_counter() - start)
+        stats["rss_mb"] = process.memory_info().rss / 2 ** 20
+        stats["rss_growth_mb"] = (process.memory_info().rss - rss_before) / 2 ** 20
+        results[name] = stats
+        print(f"micro {name:14} p50 {stats['p50_ms']:8.3f}ms  p99 {stats['p99_ms']:8.3f}ms  "
+              f"{stats['throughput']:10.0f}/s", file=sys.stderr)
+    return results
+
+def server_rss(server: psutil.Process) -> float:
+    # the server plus its worker processes (EXECUTION_BACKEND=process)
+    total = 0
+    for process in [server] + server.children(recursive=True):
+        try:
+            total += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            continue
+    return total / 2 ** 20
+
+def start_server(port: int, env: dict) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=dict(os.environ, **env)
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("server did not come up")
+
+async def client(url: str, code: str, messages: int, latencies: list, errors: list):
+    async with websockets.connect(url, max_size=None) as websocket:
+        await websocket.recv()
+        for _ in range(messages):
+            start = time.perf_counter()
+            await websocket.send(json.dumps({"type": "execute_code", "code": code}))
+            while True:
+                message = json.loads(await websocket.recv())
+                if message["type"] == "execution_result":
+                    # only completed executions are timed, a busy reply would pull the percentiles down
+                    latencies.append(time.perf_counter() - start)
+                    break
+                if message["type"] == "busy":
+                    errors.append("busy")
+                    break
+
+async def run_e2e_workload(url: str, code: str, clients: int, messages: int, server: psutil.Process) -> dict:
+    latencies, errors = [], []
+    peak_rss = server_rss(server)
+    tasks = [asyncio.create_task(client(url, code, messages, latencies, errors)) for _ in range(clients)]
+    start = time.perf_counter()
+    pending = set(tasks)
+    while pending:
+        _, pending = await asyncio.wait(pending, timeout=0.25)
+        peak_rss = max(peak_rss, server_rss(server))
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        if task.exception() is not None:
+            errors.append(repr(task.exception()))
+    stats = summarize(latencies, elapsed)
+    stats.update(server_rss_mb=server_rss(server), server_peak_rss_mb=peak_rss, errors=len(errors))
+    return stats
+
+def run_e2e(port: int, clients: int, messages: int, env: dict) -> dict:
+    server = start_server(port, env)
+    results = {}
+    try:
+        url = f"ws://127.0.0.1:{port}/ws"
+        server_process = psutil.Process(server.pid)
+        for name in E2E_WORKLOADS:
+            # warmup: one round per client so connection setup and caches don't land in the numbers
+            asyncio.run(run_e2e_workload(url, WORKLOADS[name], clients, 1, server_process))
+            stats = asyncio.run(run_e2e_workload(url, WORKLOADS[name], clients, messages, server_process))
+            results[name] = stats
+            print(f"e2e   {name:14} p50 {stats['p50_ms']:8.3f}ms  p99 {stats['p99_ms']:8.3f}ms  "
+                  f"{stats['throughput']:10.0f}/s  rss {stats['server_peak_rss_mb']:.0f}MB  errors {stats['errors']}",
+                  file=sys.stderr)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return results
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+def run(args) -> dict:
+    env = dict(item.split("=", 1) for item in args.env)
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "iterations": args.iterations,
+            "clients": args.clients,
+            "messages": args.messages,
+            "env": env
+        }
+    }
+    if not args.skip_micro:
+        report["micro"] = run_micro(args.iterations, args.warmup)
+    if not args.skip_e2e:
+        report["e2e"] = run_e2e(args.port, args.clients, args.messages, env)
+    return report
+
+def compare(base: dict, new: dict, threshold: float, min_delta_ms: float = 0.05) -> list:
+    # latency going up or throughput going down by more than `threshold` percent is a regression;
+    # latency changes smaller than min_delta_ms are timer noise on the microsecond workloads
+    regressions = []
+    for section in ("micro", "e2e"):
+        for name, new_stats in new.get(section, {}).items():
+            base_stats = base.get(section, {}).get(name)
+            if base_stats is None:
+                continue
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput"):
+                before, after = base_stats[metric], new_stats[metric]
+                change = (after - before) / before * 100 if before else 0.0
+                if metric == "throughput":
+                    worse = change < -threshold
+                else:
+                    worse = change > threshold and after - before > min_delta_ms
+                marker = "REGRESSION" if worse else ""
+                print(f"{section:5} {name:14} {metric:10} {before:12.3f} -> {after:12.3f} {change:+7.1f}% {marker}")
+                if worse:
+                    regressions.append((section, name, metric, change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="execution and websocket benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--out", help="write the results here as JSON")
+    run_parser.add_argument("--iterations", type=int, default=2000, help="micro: timed calls per workload")
+    run_parser.add_argument("--warmup", type=int, default=200)
+    run_parser.add_argument("--clients", type=int, default=20, help="e2e: concurrent connections")
+    run_parser.add_argument("--messages", type=int, default=50, help="e2e: executions per connection")
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--env", action="append", default=[], help="server env, KEY=VALUE")
+    run_parser.add_argument("--skip-micro", action="store_true")
+    run_parser.add_argument("--skip-e2e", action="store_true")
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="percent")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=0.05)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run(args)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.min_delta_ms)
+        print(f"{len(regressions)} regression(s) over {args.threshold}%")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analysis import analysis_cache
+from game_executor import GameExecutor
+
+# runs every program through the fast path and through exec from the same start position and
+# checks the results are identical (execution_time aside), streamed batches included.
+#
+#   python testing/fast_path_parity.py [random programs, default 2000] [seed]
+
+METHODS = ("move_up", "move_down", "move_left", "move_right")
+STEP_LITERALS = ("", "0", "1", "3", "17", "-2", "2.5", "'4'", "True", "False", "None", "steps=5", "9223372036854775807")
+
+FIXED_PROGRAMS = [
+    "player.move_up()",
+    "player.move_right(3)\nplayer.move_down(2)\nplayer.move_left(1)",
+    "for _ in range(4):\n    player.move_right(2)\n    player.move_down(1)",
+    "for i in range(5):\n    player.move_up(i)",
+    "for i in range(10, 0, -3):\n    player.move_left(i)",
+    "for i in range(3):\n    for j in range(i, 4):\n        player.move_down(j)\n    pass",
+    "for i in range(0):\n    player.move_up(1)",
+    "pass",
+    "",
+    "player.move_up(steps=2)\nplayer.move_up(-7)",
+    "for i in range(-5, 5):\n    player.move_right(i)",
+    # outside the subset, must come out the same anyway
+    "x = 3\nplayer.move_up(x)",
+    "for i in range(3):\n    player.move_up(i)\nplayer.move_down(i)",
+    "for i in range(2000):\n    player.move_up(1)",
+    "for i in range(12000):\n    player.move_up(1)",
+    "player.move_up(1)\nprint('hi')",
+]
+
+# run first on the same executor, a session's earlier runs must not make the fast path diverge
+PRIOR_RUNS = [
+    "player.move_up = lambda steps=1: None",
+    "player.move_right = player.move_left",
+    "player.score = 42",
+]
+
+def random_program(rng: random.Random, depth: int = 0) -> str:
+    lines = []
+    variables = [f"v{level}" for level in range(depth)]
+    for _ in range(rng.randint(1, 4)):
+        roll = rng.random()
+        if roll < 0.25 and depth < 3:
+            start, stop = rng.randint(-3, 3), rng.randint(0, 8)
+            args = f"{stop}" if rng.random() < 0.5 else f"{start}, {stop}"
+            body = random_program(rng, depth + 1)
+            lines.append(f"for v{depth} in range({args}):")
+            lines.extend("    " + line for line in body.splitlines())
+        elif roll < 0.3:
+            lines.append("pass")
+        else:
+            steps = rng.choice(STEP_LITERALS + tuple(variables))
+            lines.append(f"player.{rng.choice(METHODS)}({steps})")
+    return "\n".join(lines)
+
+def run(code: str, start: dict, fast_path: bool, stream: bool, prior: str = None):
+    executor = GameExecutor()
+    executor.fast_path = fast_path
+    if prior is not None:
+        executor.execute_player_code(prior)
+    executor.player.position = dict(start)
+    batches = []
+    result = executor.execute_player_code(code, batches.append if stream else None)
+    result = dict(result, actions=result["actions"].to_list())
+    result.pop("execution_time")
+    streamed = [action for batch in batches for action in batch.to_list()]
+    return result, streamed, executor.player.position
+
+def check(code: str, start: dict, prior: str = None) -> list:
+    problems = []
+    for stream in (False, True):
+        fast = run(code, start, True, stream, prior)
+        slow = run(code, start, False, stream, prior)
+        if fast != slow:
+            problems.append(f"stream={stream} start={start} prior={prior!r}\n--- code\n{code}\n--- fast\n{fast}\n--- exec\n{slow}")
+    return problems
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    programs = FIXED_PROGRAMS + [random_program(rng) for _ in range(count)]
+    starts = [{"x": 0, "y": 0}, {"x": -4, "y": 7}, {"x": 2 ** 62, "y": 0}, {"x": 1.5, "y": 0}]
+
+    failures = []
+    recognized = 0
+    for code in programs:
+        if analysis_cache.inspect(code)[1] is not None:
+            recognized += 1
+        for start in starts:
+            failures.extend(check(code, start))
+    for prior in PRIOR_RUNS:
+        for code in FIXED_PROGRAMS:
+            failures.extend(check(code, starts[0], prior))
+
+    print(f"{len(programs)} programs, {recognized} on the fast path, {len(failures)} mismatches")
+    for failure in failures[:5]:
+        print(failure)
+
+    # rough speed comparison on a typical recognized program
+    code = FIXED_PROGRAMS[2]
+    for fast_path in (True, False):
+        executor = GameExecutor()
+        executor.fast_path = fast_path
+        start = time.perf_counter()
+        for _ in range(20000):
+            executor.execute_player_code(code)
+        elapsed = time.perf_counter() - start
+        print(f"{'fast path' if fast_path else 'exec':9}: {elapsed / 20000 * 1e6:.1f}us per run")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
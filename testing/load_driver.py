@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from open_loop import LatencyHistogram, add_arguments, make_tester, print_report
+
+# runs open_loop.py's load from several processes at once, so the client isn't what saturates first.
+# every driver process gets its own event loop, 1/N of the connections and 1/N of the rate; the
+# coordinator merges their histograms and error counts into one report
+#
+#   python testing/load_driver.py poisson --processes 8 --connections 10000 --rate 2000 --duration 60
+#   python testing/load_driver.py knee --processes 8 --rate 100 --factor 1.5 --max-rate 5000
+#
+# knee runs as a fixed step schedule up to --max-rate (drivers can't agree on when to stop mid-run),
+# the knee is picked from the merged results. 10k connections need `ulimit -n` raised on the server too
+
+def raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def drive(index: int, args, processes: int, barrier, results):
+    raise_fd_limit()
+    try:
+        if args.seed is not None:
+            args.seed += index
+        tester = make_tester(args, rate_share=1 / processes, connection_share=1 / processes)
+        report = asyncio.run(tester.run(ready=barrier.wait))
+        results.put((index, report, None))
+    except Exception:
+        # don't leave the others stuck at the barrier
+        barrier.abort()
+        results.put((index, None, traceback.format_exc()))
+
+def merge_reports(reports: list) -> dict:
+    # phases line up by position, every driver ran the same schedule
+    merged = {
+        "server": reports[0]["server"],
+        "started": min(report["started"] for report in reports),
+        "drivers": len(reports),
+        "phases": [],
+        "connections": {}
+    }
+    for report in reports:
+        for key, value in report["connections"].items():
+            merged["connections"][key] = merged["connections"].get(key, 0) + value
+    for phases in zip(*(report["phases"] for report in reports)):
+        latency, service = LatencyHistogram(), LatencyHistogram()
+        errors = {}
+        for phase in phases:
+            latency.merge(LatencyHistogram.from_dict(phase["latency"]))
+            service.merge(LatencyHistogram.from_dict(phase["service"]))
+            for kind, count in phase["errors"].items():
+                errors[kind] = errors.get(kind, 0) + count
+        merged["phases"].append({
+            "name": phases[0]["name"],
+            "offered": sum(phase["offered"] for phase in phases),
+            "duration": phases[0]["duration"],
+            "sent": sum(phase["sent"] for phase in phases),
+            "completed": sum(phase["completed"] for phase in phases),
+            "errors": errors,
+            "span": max(phase["span"] for phase in phases),
+            "latency": latency.to_dict(),
+            "service": service.to_dict()
+        })
+    return merged
+
+def knee_rates(args) -> str:
+    rates = []
+    rate = args.rate
+    while rate <= args.max_rate:
+        rates.append(f"{rate:g}")
+        rate *= args.factor
+    return ",".join(rates)
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-process open-loop load driver")
+    add_arguments(parser)
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="driver processes")
+    args = parser.parse_args()
+
+    knee = args.schedule == "knee"
+    if knee:
+        if args.max_rate is None:
+            parser.error("knee needs --max-rate with more than one driver process")
+        args.schedule, args.rates = "step", knee_rates(args)
+
+    processes = max(args.processes, 1)
+    barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+    drivers = [
+        multiprocessing.Process(target=drive, args=(index, args, processes, barrier, results), daemon=True)
+        for index in range(processes)
+    ]
+    print(f"{processes} driver processes, ~{args.connections // processes} connections each", file=sys.stderr)
+    start = time.time()
+    for driver in drivers:
+        driver.start()
+
+    reports, failures = [], []
+    for _ in drivers:
+        index, report, error = results.get()
+        if error is not None:
+            failures.append((index, error))
+        else:
+            reports.append(report)
+    for driver in drivers:
+        driver.join()
+
+    for index, error in failures:
+        print(f"driver {index} failed:\n{error}", file=sys.stderr)
+    if not reports:
+        sys.exit(1)
+
+    merged = merge_reports(reports)
+    merged["elapsed"] = time.time() - start
+    print_report(merged, args.latency_factor)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(merged, f)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
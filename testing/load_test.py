@@ -257,8 +257,13 @@ for i in range(1, 10):
             
             await user.websocket.send(json.dumps(message))
             
-            response = await asyncio.wait_for(user.websocket.recv(), timeout=60)
-            response_data = json.loads(response)
+            # the server may send `queued` frames first when every worker is busy
+            deadline = exec_start + 60
+            while True:
+                response = await asyncio.wait_for(user.websocket.recv(), timeout=max(deadline - time.time(), 0))
+                response_data = json.loads(response)
+                if response_data.get("type") != "queued":
+                    break
             
             user.execution_time = time.time() - exec_start
             
@@ -272,6 +277,9 @@ for i in range(1, 10):
                 else:
                     user.error_message = data.get("error", "Unknown execution error")
                     print(f"✗ User {user.user_id} execution FAILED: {user.error_message}")
+            elif response_data.get("type") == "busy":
+                user.error_message = f"Server busy ({response_data.get('reason')})"
+                print(f"✗ User {user.user_id} execution BUSY: {response_data.get('reason')}")
             else:
                 user.error_message = "Invalid response type"
                 
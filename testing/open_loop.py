@@ -0,0 +1,478 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import websockets
+
+from load_test import ConcurrentLoadTester
+
+# open-loop load: submissions go out on a schedule whether or not earlier ones have come back, and
+# latency is measured from the time a submission was *supposed* to be sent. a server that falls behind
+# shows up as growing latency instead of quietly slowing the sender down (coordinated omission)
+#
+#   python testing/open_loop.py poisson --rate 200 --duration 60
+#   python testing/open_loop.py step --rates 50,100,200,400 --step-duration 20
+#   python testing/open_loop.py ramp --rate 10 --to-rate 500 --duration 120
+#   python testing/open_loop.py knee --rate 25 --factor 1.5 --step-duration 15
+#
+# --connections sizes the connection pool, --churn is the chance a connection is closed and replaced
+# after a submission. a submission waiting for a free connection is already late, that counts too
+
+class LatencyHistogram:
+    # log-linear buckets like HdrHistogram: values (microseconds) below 2**bits are exact, above that each
+    # power of two is split into 2**(bits-1) slots, so every value comes back within 2**(1-bits) relative error
+    def __init__(self, bits: int = 8):
+        self.bits = bits
+        self.counts = {}
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def _key(self, value: int) -> int:
+        shift = max(value.bit_length() - self.bits, 0)
+        return (shift << self.bits) | (value >> shift)
+
+    def _highest(self, key: int) -> int:
+        shift, mantissa = key >> self.bits, key & ((1 << self.bits) - 1)
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds: float, count: int = 1):
+        value = max(int(seconds * 1e6), 0)
+        key = self._key(value)
+        self.counts[key] = self.counts.get(key, 0) + count
+        self.total += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.bits != self.bits:
+            raise ValueError("histograms use different precision")
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        # seconds; the top of the bucket holding the q-th value, never above the largest value seen
+        if not self.total:
+            return 0.0
+        rank = max(1, int(q / 100 * self.total + 0.5))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                return min(self._highest(key), self.max) / 1e6
+        return self.max / 1e6
+
+    def mean(self) -> float:
+        return self.sum / self.total / 1e6 if self.total else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "bits": self.bits,
+            "counts": {str(key): count for key, count in self.counts.items()},
+            "total": self.total,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        histogram = cls(data["bits"])
+        histogram.counts = {int(key): count for key, count in data["counts"].items()}
+        histogram.total = data["total"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+def constant_rate(rate: float):
+    return lambda t: rate
+
+def linear_rate(start: float, end: float, duration: float):
+    return lambda t: start + (end - start) * min(t / duration, 1.0)
+
+def arrivals(rate_at, duration: float, rng: random.Random, poisson: bool = True):
+    # send offsets within [0, duration); exponential gaps at the current rate, or evenly spaced
+    t = 0.0
+    while True:
+        rate = rate_at(t)
+        if rate <= 0:
+            t += 0.01
+        else:
+            t += rng.expovariate(rate) if poisson else 1.0 / rate
+        if t >= duration:
+            return
+        if rate > 0:
+            yield t
+
+def make_phases(args) -> list:
+    # [(name, offered rate, rate function, duration)], each phase reported on its own
+    if args.schedule == "poisson":
+        return [(f"{args.rate:g}/s", args.rate, constant_rate(args.rate), args.duration)]
+    if args.schedule == "knee":
+        # the first step, OpenLoopTester.run adds the rest as it goes
+        return [(f"{args.rate:g}/s", args.rate, constant_rate(args.rate), args.step_duration)]
+    if args.schedule == "step":
+        rates = [float(rate) for rate in args.rates.split(",")]
+        return [(f"{rate:g}/s", rate, constant_rate(rate), args.step_duration) for rate in rates]
+    if args.schedule == "ramp":
+        windows = max(args.windows, 1)
+        width = args.duration / windows
+        phases = []
+        for window in range(windows):
+            start = args.rate + (args.to_rate - args.rate) * window / windows
+            end = args.rate + (args.to_rate - args.rate) * (window + 1) / windows
+            phases.append((f"{start:g}-{end:g}/s", (start + end) / 2, linear_rate(start, end, width), width))
+        return phases
+    raise ValueError(f"unknown schedule: {args.schedule}")
+
+class PhaseResult:
+    def __init__(self, name: str, offered: float, duration: float):
+        self.name = name
+        self.offered = offered
+        self.duration = duration
+        self.sent = 0
+        self.completed = 0
+        self.errors = {}
+        # from the intended send time, and from when the frame actually went out
+        self.latency = LatencyHistogram()
+        self.service = LatencyHistogram()
+        self.first_intended = None
+        self.last_completion = None
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "offered": self.offered,
+            "duration": self.duration,
+            "sent": self.sent,
+            "completed": self.completed,
+            "errors": self.errors,
+            "span": (self.last_completion - self.first_intended) if self.last_completion is not None else 0.0,
+            "latency": self.latency.to_dict(),
+            "service": self.service.to_dict()
+        }
+
+def summarize(phase: dict) -> dict:
+    latency = LatencyHistogram.from_dict(phase["latency"])
+    service = LatencyHistogram.from_dict(phase["service"])
+    # completions over the time from the phase's first intended send to its last answer, so a backlog
+    # that drains after the phase ended pulls the rate down
+    span = max(phase["span"], phase["duration"])
+    return {
+        "name": phase["name"],
+        "offered": phase["offered"],
+        "sent_rate": phase["sent"] / phase["duration"] if phase["duration"] > 0 else 0.0,
+        "achieved": phase["completed"] / span if span > 0 else 0.0,
+        "completed": phase["completed"],
+        "errors": sum(phase["errors"].values()),
+        "p50": latency.percentile(50),
+        "p90": latency.percentile(90),
+        "p99": latency.percentile(99),
+        "p999": latency.percentile(99.9),
+        "max": latency.max / 1e6,
+        "service_p99": service.percentile(99)
+    }
+
+def find_knee(summaries: list, efficiency: float = 0.9, latency_factor: float = 5.0):
+    # the first phase that either can't keep up with its offered rate or whose p99 blew up against the
+    # first phase's; the one before it is the usable throughput
+    if not summaries:
+        return None
+    baseline = max(summaries[0]["p99"], 1e-3)
+    for index, summary in enumerate(summaries):
+        # against what was actually sent, a short poisson phase can land well off its nominal rate
+        saturated = summary["achieved"] < efficiency * summary["sent_rate"]
+        if saturated or summary["p99"] > latency_factor * baseline or summary["errors"] > 0.01 * max(summary["completed"], 1):
+            return {
+                "phase": summary["name"],
+                "usable": summaries[index - 1]["name"] if index > 0 else None,
+                "usable_throughput": summaries[index - 1]["achieved"] if index > 0 else 0.0,
+                "reason": "throughput" if saturated else ("latency" if summary["p99"] > latency_factor * baseline else "errors")
+            }
+    return None
+
+class ConnectionPool:
+    def __init__(self, url: str, size: int, churn: float, rng: random.Random):
+        self.url = url
+        self.size = size
+        self.churn = churn
+        self.rng = rng
+        self.idle = asyncio.Queue()
+        self.open_count = 0
+        self.opened = 0
+        self.churned = 0
+        self.failed = 0
+
+    async def open(self):
+        self.open_count += 1
+        try:
+            websocket = await websockets.connect(self.url, max_size=None)
+            await asyncio.wait_for(websocket.recv(), timeout=10)
+        except Exception:
+            self.open_count -= 1
+            self.failed += 1
+            raise
+        self.opened += 1
+        return websocket
+
+    async def fill(self, count: int, concurrency: int = 100):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                try:
+                    self.idle.put_nowait(await self.open())
+                except Exception:
+                    pass
+
+        await asyncio.gather(*(one() for _ in range(count)))
+
+    async def acquire(self):
+        if self.idle.empty() and self.open_count < self.size:
+            return await self.open()
+        return await self.idle.get()
+
+    def release(self, websocket, broken: bool = False):
+        if broken or (self.churn and self.rng.random() < self.churn):
+            if not broken:
+                self.churned += 1
+            self.open_count -= 1
+            asyncio.create_task(self.close(websocket))
+        else:
+            self.idle.put_nowait(websocket)
+
+    async def close(self, websocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    async def close_all(self):
+        closing = []
+        while not self.idle.empty():
+            closing.append(self.close(self.idle.get_nowait()))
+        await asyncio.gather(*closing)
+
+class OpenLoopTester:
+    def __init__(self, server_url: str, phases: list, programs: list, connections: int = 100, churn: float = 0.0,
+                 poisson: bool = True, timeout: float = 30.0, max_outstanding: int = 10000, seed: int = None):
+        self.server_url = server_url
+        self.phases = phases
+        self.programs = programs
+        self.poisson = poisson
+        self.timeout = timeout
+        self.max_outstanding = max_outstanding
+        self.rng = random.Random(seed)
+        self.pool = ConnectionPool(server_url, connections, churn, self.rng)
+        self.outstanding = set()
+
+    async def submit(self, intended: float, result: PhaseResult):
+        loop = asyncio.get_running_loop()
+        try:
+            websocket = await asyncio.wait_for(self.pool.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            result.error("no_connection")
+            return
+        except Exception:
+            result.error("connect")
+            return
+        broken = False
+        try:
+            sent = loop.time()
+            await websocket.send(json.dumps({"type": "execute_code", "code": self.rng.choice(self.programs)}))
+            deadline = intended + self.timeout
+            while True:
+                message = json.loads(await asyncio.wait_for(websocket.recv(), timeout=max(deadline - loop.time(), 0.001)))
+                if message["type"] in ("execution_result", "busy"):
+                    break
+            done = loop.time()
+            if message["type"] == "busy":
+                result.error(f"busy_{message.get('reason')}")
+            elif not message["data"].get("success"):
+                result.error("execution")
+            else:
+                result.completed += 1
+                result.latency.record(done - intended)
+                result.service.record(done - sent)
+                result.last_completion = done
+        except asyncio.TimeoutError:
+            broken = True
+            result.error("timeout")
+        except Exception:
+            broken = True
+            result.error("connection")
+        finally:
+            self.pool.release(websocket, broken)
+
+    def spawn(self, intended: float, result: PhaseResult):
+        result.sent += 1
+        if len(self.outstanding) >= self.max_outstanding:
+            # the client itself is saturated, the run stops meaning anything past this point
+            result.error("client_overflow")
+            return
+        task = asyncio.create_task(self.submit(intended, result))
+        self.outstanding.add(task)
+        task.add_done_callback(self.outstanding.discard)
+
+    async def run_phase(self, name: str, offered: float, rate_at, duration: float) -> PhaseResult:
+        loop = asyncio.get_running_loop()
+        result = PhaseResult(name, offered, duration)
+        start = loop.time()
+        result.first_intended = start
+        for offset in arrivals(rate_at, duration, self.rng, self.poisson):
+            intended = start + offset
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.spawn(intended, result)
+        delay = start + duration - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return result
+
+    async def drain(self):
+        if self.outstanding:
+            await asyncio.wait(set(self.outstanding), timeout=self.timeout)
+
+    async def run(self, knee_factor: float = None, max_rate: float = None, latency_factor: float = 5.0,
+                  progress=None, ready=None) -> dict:
+        # phases run back to back; with knee_factor the last phase keeps repeating at knee_factor times
+        # the rate until the knee shows up or max_rate is passed, each step drained before judging it
+        await self.pool.fill(self.pool.size)
+        if ready is not None:
+            # blocking hook between connecting and the first send, e.g. a barrier shared by driver processes
+            await asyncio.get_running_loop().run_in_executor(None, ready)
+        results = []
+        started = time.time()
+        try:
+            phases = list(self.phases)
+            while phases:
+                name, offered, rate_at, duration = phases.pop(0)
+                result = await self.run_phase(name, offered, rate_at, duration)
+                results.append(result)
+                if knee_factor:
+                    await self.drain()
+                    summaries = [summarize(r.to_dict()) for r in results]
+                    if progress is not None:
+                        progress(summaries[-1])
+                    rate = offered * knee_factor
+                    if find_knee(summaries, latency_factor=latency_factor) is None and (max_rate is None or rate <= max_rate):
+                        phases.append((f"{rate:g}/s", rate, constant_rate(rate), duration))
+                elif progress is not None:
+                    progress(summarize(result.to_dict()))
+            await self.drain()
+        finally:
+            for task in list(self.outstanding):
+                task.cancel()
+            await self.pool.close_all()
+        return {
+            "server": self.server_url,
+            "started": started,
+            "phases": [result.to_dict() for result in results],
+            "connections": {
+                "pool": self.pool.size,
+                "opened": self.pool.opened,
+                "churned": self.pool.churned,
+                "failed": self.pool.failed
+            }
+        }
+
+def print_phase(summary: dict):
+    print(
+        f"{summary['name']:>16} offered {summary['offered']:8.1f}/s achieved {summary['achieved']:8.1f}/s | "
+        f"p50 {summary['p50'] * 1000:8.1f}ms p90 {summary['p90'] * 1000:8.1f}ms p99 {summary['p99'] * 1000:8.1f}ms "
+        f"p99.9 {summary['p999'] * 1000:8.1f}ms max {summary['max'] * 1000:8.1f}ms | "
+        f"service p99 {summary['service_p99'] * 1000:8.1f}ms | errors {summary['errors']}",
+        file=sys.stderr
+    )
+
+def print_report(report: dict, latency_factor: float = 5.0):
+    summaries = [summarize(phase) for phase in report["phases"]]
+    print(f"\nserver {report['server']} | connections {report['connections']}")
+    for summary, phase in zip(summaries, report["phases"]):
+        print_phase(summary)
+        if phase["errors"]:
+            print(f"{'':>16} errors: {phase['errors']}", file=sys.stderr)
+    knee = find_knee(summaries, latency_factor=latency_factor)
+    if knee is None:
+        print("no knee found, the server kept up with every phase")
+    else:
+        print(f"knee at {knee['phase']} ({knee['reason']}), usable up to {knee['usable']} "
+              f"~{knee['usable_throughput']:.1f}/s")
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("schedule", choices=("poisson", "step", "ramp", "knee"))
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--rate", type=float, default=50.0, help="submissions per second (start rate for ramp/knee)")
+    parser.add_argument("--to-rate", type=float, default=500.0, help="ramp: final rate")
+    parser.add_argument("--rates", default="25,50,100,200", help="step: comma separated rates")
+    parser.add_argument("--duration", type=float, default=60.0, help="poisson/ramp: seconds")
+    parser.add_argument("--step-duration", type=float, default=20.0, help="step/knee: seconds per step")
+    parser.add_argument("--windows", type=int, default=10, help="ramp: reporting windows")
+    parser.add_argument("--factor", type=float, default=1.5, help="knee: rate multiplier per step")
+    parser.add_argument("--max-rate", type=float, default=None, help="knee: stop after this rate")
+    parser.add_argument("--latency-factor", type=float, default=5.0,
+                        help="a phase whose p99 is this many times the first phase's is past the knee")
+    parser.add_argument("--uniform", action="store_true", help="evenly spaced sends instead of poisson arrivals")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--churn", type=float, default=0.0, help="chance a connection is replaced after a submission")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-outstanding", type=int, default=10000)
+    parser.add_argument("--code", help="file with the program to submit (default: the load_test programs)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", help="write the report (histograms included) as JSON")
+
+def make_tester(args, rate_share: float = 1.0, connection_share: float = 1.0) -> OpenLoopTester:
+    # the shares let several driver processes split one schedule between them
+    phases = [
+        (name, offered * rate_share, (lambda rate_at: lambda t: rate_at(t) * rate_share)(rate_at), duration)
+        for name, offered, rate_at, duration in make_phases(args)
+    ]
+    if args.code:
+        with open(args.code) as f:
+            programs = [f.read()]
+    else:
+        programs = ConcurrentLoadTester().complex_codes
+    return OpenLoopTester(
+        args.url, phases, programs,
+        connections=max(int(args.connections * connection_share), 1),
+        churn=args.churn,
+        poisson=not args.uniform,
+        timeout=args.timeout,
+        max_outstanding=args.max_outstanding,
+        seed=args.seed
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="open-loop websocket load generator")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    tester = make_tester(args)
+    report = asyncio.run(tester.run(
+        knee_factor=args.factor if args.schedule == "knee" else None,
+        max_rate=args.max_rate,
+        latency_factor=args.latency_factor,
+        progress=print_phase
+    ))
+    print_report(report, args.latency_factor)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f)
+
+if __name__ == "__main__":
+    main()
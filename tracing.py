@@ -0,0 +1,70 @@
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+class Trace:
+    # per-stage timings of one sampled message; spans are (stage, start, end) in perf_counter seconds,
+    # which is a system-wide monotonic clock so worker processes can add their own spans
+    __slots__ = ("trace_id", "name", "start", "spans", "meta")
+
+    def __init__(self, trace_id: int, name: str, **meta):
+        self.trace_id = trace_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self.meta = meta
+
+    def add(self, stage: str, start: float, end: float):
+        self.spans.append((stage, start, end))
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "meta": self.meta,
+            "spans": [
+                {"stage": stage, "start_ms": (start - self.start) * 1000, "duration_ms": (end - start) * 1000}
+                for stage, start, end in sorted(self.spans, key=lambda span: span[1])
+            ]
+        }
+
+class Tracer:
+    # with sample_rate 0 start() returns None and every call site skips its timing entirely
+    def __init__(self, sample_rate: float = 0.0, capacity: int = 1024, trace_file: str = None):
+        self.sample_rate = sample_rate
+        self.traces = deque(maxlen=capacity)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.trace_file = open(trace_file, "a", buffering=1) if trace_file else None
+
+    def start(self, name: str, **meta):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        return Trace(next(self.ids), name, **meta)
+
+    def finish(self, trace: Trace):
+        if trace is None:
+            return
+        record = trace.to_dict()
+        with self.lock:
+            self.traces.append(record)
+            if self.trace_file is not None:
+                self.trace_file.write(json.dumps(record) + "\n")
+
+    def dump(self, clear: bool = False) -> list:
+        with self.lock:
+            traces = list(self.traces)
+            if clear:
+                self.traces.clear()
+        return traces
+
+def tracer_from_env() -> Tracer:
+    return Tracer(
+        float(os.environ.get("TRACE_SAMPLE_RATE", 0)),
+        int(os.environ.get("TRACE_BUFFER", 1024)),
+        os.environ.get("TRACE_FILE")
+    )